@@ -20,24 +20,50 @@
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # 
 
 import os
+import posixpath
+import shutil
 import re
 import sys
 import time
+import socket
 import tarfile
+import multiprocessing
 import sqlite3 as sq
+import json
 from json import loads
 from io import BytesIO
-from cgi import escape
-from struct import pack
-from zlib import decompress
-from hashlib import md5,sha1
+from html import escape
+from struct import pack, unpack
+from zlib import decompressobj, error as ZlibError
+from hashlib import md5,sha1,sha256,pbkdf2_hmac
 from base64 import b64decode
 from binascii import hexlify,unhexlify
 from datetime import datetime
 from datetime import timedelta
 from subprocess import check_output as co
 from subprocess import call
+from subprocess import Popen, PIPE, TimeoutExpired, CalledProcessError
+from argparse import ArgumentParser
+from threading import Lock, BoundedSemaphore, local
+from itertools import count, islice, groupby
+from operator import itemgetter
+from functools import reduce, lru_cache, partial
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from webbrowser import open_new_tab
+from mmap import mmap, ACCESS_READ
+from getpass import getpass
+# Password protected Android backups need one of these for AES
+try:
+	from Crypto.Cipher import AES
+	aes_cbc = lambda key, iv: AES.new(key, AES.MODE_CBC, iv).decrypt
+except ImportError:
+	try:
+		from cryptography.hazmat.backends import default_backend
+		from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+		aes_cbc = lambda key, iv: Cipher(algorithms.AES(key), modes.CBC(iv), backend=default_backend()).decryptor().update
+	except ImportError:
+		aes_cbc = None
 
 # Setting variables
 __author__ = "Denis Sazonov"
@@ -53,195 +79,611 @@ gICB8ICBcLyAvXy8gfCB8ICB8IFwvICB8ICB8X3wgIHxfXCAgX19fL3wgIHwgXC8KXF9fX198X18gIC9
 vXF9fX18gfCB8X198ICB8X198X19fXy9fX19fL1xfX18gID5fX3wgICAKICAgICAgICBcLyAgICAgXC8gICAgICB\
 cLyAgIFZlcnNpb246IHswfSAgXC8gICAgICAgCiAgICAgICAgICAgICAgICAgICAgICAgICBCdWlsZCBkYXRlOiB\
 7MX0KICAgICAgICAgICAgICAgICAgICAgICAgICAgIFdlYnNpdGU6IHsyfQ=='
-print(b64decode(logo).decode().format(__version__, __build_date__, __website__))
 
-REPORT = []		# List to be populated for generating the REPORT.html file
-ERRORS = []		# List to be populated with errors occured
+# Command line options
+parser = ArgumentParser(description='Forensic acquisition tool for Android devices.')
+parser.add_argument('--tar', action='store_true', help='rooted devices: stream all databases in one \'tar\' over \'adb exec-out\'')
+parser.add_argument('--workers', type=int, default=4, metavar='N', help='number of files pulled concurrently (default: 4)')
+parser.add_argument('--verify', action='store_true', help='rooted devices: check every pulled file against md5sum/sha1sum run on the device')
+parser.add_argument('--previous', metavar='CASE', help='rooted devices: reuse files unchanged since this earlier case folder of the same device')
+parser.add_argument('--probe-timeout', type=float, default=30, metavar='SECONDS', help='give up on a device information probe after this long (default: 30)')
+parser.add_argument('--transport', choices=('binary', 'socket'), default='binary', help='run the adb binary for every call, or talk to the adb server socket directly (default: binary)')
+parser.add_argument('--record', metavar='DIR', help='save every adb call, its output and pulled files into a fixture directory')
+parser.add_argument('--replay', metavar='DIR', help='run offline, answering adb calls from a recorded fixture directory')
+parser.add_argument('--replay-latency', type=float, default=0, metavar='SECONDS', help='delay added to every replayed adb call (default: 0)')
+parser.add_argument('--replay-bandwidth', type=float, default=0, metavar='MB', help='replayed transfer rate in MB/s, 0 for unlimited (default: 0)')
+parser.add_argument('--ab-catalog', metavar='BACKUP', help='list the members of an Android backup file from its catalog (built on first use), without a device')
+parser.add_argument('--ab-password', metavar='PASSWORD', help='password of an encrypted Android backup (asked for when needed if not given)')
+parser.add_argument('--ab-extract', metavar='GLOB', help='with --ab-catalog: extract the members matching GLOB into BACKUP_extract')
+parser.add_argument('--in-memory', action='store_true', help='Android backups: decode databases from memory, writing the evidence copies to OUTPUT/db in the background')
+parser.add_argument('--no-db-copy', action='store_true', help='with --in-memory: do not keep copies of the databases in OUTPUT/db (checksums are still recorded)')
+parser.add_argument('--crack', metavar='PASSWORD_KEY', help='crack a lockscreen password.key on its own, without a device (needs --salt or --salt-db)')
+parser.add_argument('--salt', type=int, help='with --crack: the lockscreen.password_salt value')
+parser.add_argument('--salt-db', metavar='DB', help='with --crack: settings.db or locksettings.db to read the salt from')
+parser.add_argument('--checkpoint', metavar='FILE', help='with --crack: where progress is saved and resumed from (default: PASSWORD_KEY.checkpoint)')
+parser.add_argument('--mask', action='append', metavar='MASK', help='also try passwords matching MASK: ?d digit, ?l lower, ?u upper, ?s symbol, ?a any (repeatable)')
+parser.add_argument('--wordlist', metavar='FILE', help='also try the words in FILE, changed by the rules')
+parser.add_argument('--rules', metavar='FILE', help='rules applied to --wordlist words, one per line (default: a few common ones)')
+parser.add_argument('--pin-max-length', type=int, metavar='N', help='try lockscreen PINs of 4 up to N digits (default: 4 for a 1024-round password.key found while decoding, 8 otherwise and with --crack)')
+parser.add_argument('--pin-workers', type=int, default=0, metavar='N', help='processes cracking the PIN or password (default: one per CPU core)')
+parser.add_argument('--gesture-table', metavar='FILE', help='lookup table for lockscreen patterns, built on first use (default: gesture.table next to Andriller.py)')
+parser.add_argument('--decode-workers', type=int, default=4, metavar='N', help='number of decoders run at the same time (default: 4)')
+parser.add_argument('--visible-contacts', action='store_true', help='list only the contacts shown in the Contacts app (the visible_contacts view of contacts2.db)')
+parser.add_argument('--page-rows', type=int, default=2000, metavar='N', help='split report tables of more than N rows into pages with an index page (default: 2000, 0 for one page)')
+parser.add_argument('--json-tables', action='store_true', help='write report table rows to a JSON data file shown in a scrolling viewer, instead of HTML rows')
+parser.add_argument('-s', '--serial', help='acquire the device with this adb serial')
+parser.add_argument('--all-devices', action='store_true', help='acquire every attached device at the same time, each in its own folder')
+parser.add_argument('--max-transfers', type=int, default=4, metavar='N', help='cap on adb transfers running at once, across all devices (default: 4)')
+ARGS = parser.parse_args([])	# replaced by the real command line in __main__
+
+# While a decoder thread captures, what it adds to REPORT or ERRORS is kept
+# aside and replayed later, so decoders run in parallel but merge in order
+class CapturedList(list):
+	def __init__(self):
+		list.__init__(self)
+		self.local = local()
+
+	def capture(self):
+		self.local.ops = []
+
+	def release(self):
+		ops, self.local.ops = self.local.ops, None
+		return ops
+
+	def replay(self, ops):
+		for op, args in ops:
+			getattr(list, op)(self, *args)
+
+	def record(self, op, *args):
+		ops = getattr(self.local, 'ops', None)
+		if ops == None:
+			getattr(list, op)(self, *args)
+		else:
+			ops.append((op, args))
+
+	def append(self, item):
+		self.record('append', item)
+
+	def insert(self, index, item):
+		self.record('insert', index, item)
+
+REPORT = CapturedList()		# List to be populated for generating the REPORT.html file
+ERRORS = CapturedList()		# List to be populated with errors occured
 extraction_started = time.time()
+TRANSFERS = BoundedSemaphore(ARGS.max_transfers)	# shared between devices with --all-devices
+
+# Stop on a fatal error; only wait for 'Enter' when a single device is acquired
+def die(msg):
+	if ARGS.all_devices:
+		print(msg)
+	else:
+		input(msg + "\n Press 'Enter' to exit.")
+	sys.exit(1)
 
 # Check OS and define adb
 download_adb = ' ERROR! \n\'./adb\' file is not present!\n Download it from \
 http://android.saz.lt/download/adb.zip\n Unzip, and place them into this \
 directory;\n Run the program again.'
-# Check OS, define adb executable and path SEParator
-if 'linux' in sys.platform:
-	SEP = '/'
-	if call(['which', 'adb']) == 0:
-		ADB = "adb"; print('', end='\r')
-	else:
-		ADB = './adb'
-		if os.path.isfile(ADB) == True:
-			os.chmod(ADB, '0755')
-		else:
-			input(download_adb + "\n Press 'Enter' to exit.")
-			sys.exit()
-elif 'win32' in sys.platform:
-	ADB = "adb.exe"
+ADB = None	# adb executable, set by find_adb()
+# Path SEParator
+if 'win32' in sys.platform:
 	SEP = '\\'
-	if os.path.isfile(ADB) == False:
-		input(download_adb + "\n Press 'Enter' to exit.")
-		sys.exit()
-elif 'darwin' in sys.platform:
-	ADB = "./adb_mac"
+else:
 	SEP = '/'
-	if os.path.isfile(ADB) == False:
-		input(download_adb + "\n Press 'Enter' to exit.")
-		sys.exit()
-try:
-	ADB; co([ADB, 'start-server'])
-except NameError:
-	input(" ERROR! Cannot determine OS!\n Press 'Enter' to exit.")
-	sys.exit()
+# Check OS, define adb executable
+def find_adb():
+	global ADB
+	if 'linux' in sys.platform:
+		if call(['which', 'adb']) == 0:
+			ADB = "adb"; print('', end='\r')
+		else:
+			ADB = './adb'
+			if os.path.isfile(ADB) == True:
+				os.chmod(ADB, '0755')
+			else:
+				die(download_adb)
+	elif 'win32' in sys.platform:
+		ADB = "adb.exe"
+		if os.path.isfile(ADB) == False:
+			die(download_adb)
+	elif 'darwin' in sys.platform:
+		ADB = "./adb_mac"
+		if os.path.isfile(ADB) == False:
+			die(download_adb)
+	else:
+		die(" ERROR! Cannot determine OS!")
+	TRANSPORT.check_output(['start-server'])
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-# Unrooted (shell) devices, to print device information, limited extractions 
+# ADB TRANSPORTS
 #
-#print('{0:\u00B0^60}'.format(' General Device Information '))
-print('{0:\u00B0^60}'.format(' General Device Information '))
+# Every adb call goes through TRANSPORT: check_output(args) and stream(args),
+# args being everything after the adb executable. AdbTransport runs the real
+# binary, AdbRecorder also saves each call into a fixture directory, and
+# AdbReplayer answers from such a fixture with no device or adb at all.
+class AdbTransport:
+	def check_output(self, args, timeout=None):
+		return co([ADB] + args, timeout=timeout)
 
-# Check for connected Android device
-if 'unknown' in co([ADB, 'get-state']).decode('UTF-8'):
-	input(" No Android device found!\n Press 'Enter' to exit."); sys.exit()
-else:
-	ADB_SER = co([ADB, 'get-serialno']).decode('UTF-8').replace('\n', '').replace('\r', '')
-	print(" ADB serial: " + ADB_SER); REPORT.append(["ADB serial", ADB_SER])
+	def stream(self, args):
+		return Popen([ADB] + args, stdout=PIPE)
 
-# Check permissions
-QPERM = co([ADB, 'shell', 'id']).decode('UTF-8')
-if 'root' in QPERM:
-	PERM = 'root'
-else:
-	QPERMSU = co([ADB, 'shell', 'su', '-c', 'id']).decode('UTF-8')
-	if 'root' in QPERMSU:
-		PERM = 'root(su)'
+# Local files an adb call writes: the target of 'pull', the '-f' of 'backup'
+def local_outputs(args):
+	if 'pull' in args:
+		return [len(args)-1]
+	if 'backup' in args and '-f' in args:
+		return [args.index('-f')+1]
+	return []
+
+# Fixture lookup key: staging names and the case folder differ between runs
+def fixture_key(args):
+	key = []
+	for arg in args:
+		arg = re.sub(r'andriller-\d+-\d+', 'andriller-#', arg)
+		if OUTPUT and arg.startswith(OUTPUT):
+			arg = '<OUTPUT>'+arg[len(OUTPUT):]
+		key.append(arg)
+	return key
+
+class AdbRecorder(AdbTransport):
+	def __init__(self, fixture, inner):
+		self.fixture, self.inner = fixture, inner
+		self.seq = count()
+		for sub in ('calls', 'blobs'):
+			if not os.path.isdir(fixture+SEP+sub):
+				os.makedirs(fixture+SEP+sub)
+
+	# Blobs are named by their SHA-256, so pulled files recorded twice are stored once
+	def save_blob(self, src):
+		tmp = self.fixture+SEP+'blobs'+SEP+'tmp-{0}-{1}'.format(os.getpid(), next(self.seq))
+		with open(tmp, 'wb') as blob_h:
+			digest = copy_hashed(src, blob_h)['sha256']
+		os.replace(tmp, self.fixture+SEP+'blobs'+SEP+digest)
+		return digest
+
+	# One JSON file per call keeps concurrent threads and device processes apart
+	def save_call(self, args, kind, returncode, output, timeout=False):
+		call_rec = {'key': fixture_key(args), 'kind': kind, 'returncode': returncode, 'timeout': timeout, 'output': output, 'files': {}}
+		for pos in local_outputs(args):
+			if returncode == 0 and os.path.isfile(args[pos]):
+				with open(args[pos], 'rb') as file_h:
+					call_rec['files'][str(pos)] = self.save_blob(file_h)
+		name = '{0:020d}-{1}-{2}.json'.format(int(time.time()*1000000), os.getpid(), next(self.seq))
+		with open(self.fixture+SEP+'calls'+SEP+name, 'w', encoding='UTF-8') as call_h:
+			json.dump(call_rec, call_h)
+
+	def check_output(self, args, timeout=None):
+		try:
+			out = self.inner.check_output(args, timeout)
+		except CalledProcessError as e:
+			self.save_call(args, 'co', e.returncode, self.save_blob(BytesIO(e.output or b'')))
+			raise
+		except TimeoutExpired:
+			self.save_call(args, 'co', None, None, timeout=True)
+			raise
+		self.save_call(args, 'co', 0, self.save_blob(BytesIO(out)))
+		return out
+
+	def stream(self, args):
+		return RecordedStream(self, args, self.inner.stream(args))
+
+# A running stream whose bytes are also written to the fixture
+class RecordedStream:
+	def __init__(self, recorder, args, proc):
+		self.recorder, self.args, self.proc = recorder, args, proc
+		self.copy = open(recorder.fixture+SEP+'blobs'+SEP+'tmp-{0}-{1}'.format(os.getpid(), next(recorder.seq)), 'w+b')
+		self.stdout = self
+
+	def read(self, size=-1):
+		data = self.proc.stdout.read(size)
+		self.copy.write(data)
+		return data
+
+	def close(self):
+		self.proc.stdout.close()
+
+	def wait(self):
+		returncode = self.proc.wait()
+		self.copy.seek(0)
+		output = self.recorder.save_blob(self.copy)
+		self.copy.close()
+		os.remove(self.copy.name)
+		self.recorder.save_call(self.args, 'stream', returncode, output)
+		return returncode
+
+class AdbReplayer(AdbTransport):
+	def __init__(self, fixture, latency=0, bandwidth=0):
+		self.fixture, self.latency, self.bandwidth = fixture, latency, bandwidth
+		self.calls, self.lock = {}, Lock()
+		for name in sorted(os.listdir(fixture+SEP+'calls')):
+			with open(fixture+SEP+'calls'+SEP+name, 'r', encoding='UTF-8') as call_h:
+				call_rec = json.load(call_h)
+			self.calls.setdefault((call_rec['kind'],)+tuple(call_rec['key']), []).append(call_rec)
+
+	# Recorded answers are served in order, the last one repeats
+	def next_call(self, kind, args):
+		time.sleep(self.latency)
+		with self.lock:
+			answers = self.calls.get((kind,)+tuple(fixture_key(args)))
+			if not answers:
+				return None
+			return answers.pop(0) if len(answers) > 1 else answers[0]
+
+	def throttle(self, nbytes):
+		if self.bandwidth > 0:
+			time.sleep(nbytes/self.bandwidth)
+
+	def blob(self, digest):
+		return self.fixture+SEP+'blobs'+SEP+digest
+
+	def check_output(self, args, timeout=None):
+		call_rec = self.next_call('co', args)
+		if call_rec == None:
+			raise CalledProcessError(1, ['adb']+args, b'')
+		if call_rec['timeout']:
+			raise TimeoutExpired(['adb']+args, timeout)
+		for pos, digest in call_rec['files'].items():
+			self.throttle(os.path.getsize(self.blob(digest)))
+			shutil.copyfile(self.blob(digest), args[int(pos)])
+		with open(self.blob(call_rec['output']), 'rb') as blob_h:
+			out = blob_h.read()
+		self.throttle(len(out))
+		if call_rec['returncode'] != 0:
+			raise CalledProcessError(call_rec['returncode'], ['adb']+args, out)
+		return out
+
+	def stream(self, args):
+		call_rec = self.next_call('stream', args)
+		if call_rec == None:
+			return ReplayedStream(self, BytesIO(b''), 1)
+		return ReplayedStream(self, open(self.blob(call_rec['output']), 'rb'), call_rec['returncode'])
+
+# A recorded stream, read back at the replay bandwidth
+class ReplayedStream:
+	def __init__(self, replayer, blob_h, returncode):
+		self.replayer, self.blob_h, self.returncode = replayer, blob_h, returncode
+		self.stdout = self
+
+	def read(self, size=-1):
+		data = self.blob_h.read(size)
+		self.replayer.throttle(len(data))
+		return data
+
+	def close(self):
+		self.blob_h.close()
+
+	def wait(self):
+		return self.returncode
+
+# Talks the adb host protocol to the adb server on TCP 5037 directly, instead
+# of starting the adb binary for every call. Shell and exec services need a
+# fresh connection each (the service takes the socket over); sync sessions
+# for pulls stay open and are reused, one per worker and device.
+class AdbSocketTransport(AdbTransport):
+	def __init__(self, host='127.0.0.1', port=5037):
+		self.addr = (host, port)
+		self.sync_idle, self.lock = {}, Lock()
+
+	# 4 hex digit length, payload; answered by OKAY or FAIL and a message
+	def request(self, sock, service, args):
+		service = service.encode('UTF-8')
+		sock.sendall('{0:04x}'.format(len(service)).encode()+service)
+		status = recv_exact(sock, 4)
+		if status != b'OKAY':
+			msg = recv_exact(sock, int(recv_exact(sock, 4), 16)) if status == b'FAIL' else status
+			sock.close()
+			raise CalledProcessError(1, ['adb']+args, msg)
+
+	# Host services answer with one length-prefixed block
+	def host_query(self, service, args, timeout=None):
+		sock = socket.create_connection(self.addr, timeout)
+		try:
+			self.request(sock, service, args)
+			return recv_exact(sock, int(recv_exact(sock, 4), 16))
+		finally:
+			sock.close()
+
+	def open_service(self, serial, service, args, timeout=None):
+		sock = socket.create_connection(self.addr, timeout)
+		self.request(sock, 'host:transport:'+serial if serial else 'host:transport-any', args)
+		self.request(sock, service, args)
+		return sock
+
+	def check_output(self, args, timeout=None):
+		serial, cmd = (args[1], args[2:]) if args[:1] == ['-s'] else (None, args)
+		try:
+			if cmd[0] in ('shell', 'exec-out'):
+				sock = self.open_service(serial, ('shell:' if cmd[0] == 'shell' else 'exec:')+' '.join(cmd[1:]), args, timeout)
+				try:
+					with sock.makefile('rb') as sock_h:
+						return sock_h.read()
+				finally:
+					sock.close()
+			if cmd[0] == 'pull':
+				self.pull(serial, cmd[1], cmd[2], args)
+				return b''
+			if cmd[0] in ('get-state', 'get-serialno'):
+				return self.host_query(('host-serial:'+serial+':' if serial else 'host:')+cmd[0], args, timeout)+b'\n'
+			if cmd[0] == 'devices':
+				return b'List of devices attached\n'+self.host_query('host:devices', args, timeout)
+			if cmd[0] == 'start-server':
+				return self.host_query('host:version', args, timeout)
+		except socket.timeout:
+			raise TimeoutExpired(['adb']+args, timeout)
+		except socket.error as e:
+			if cmd[0] != 'start-server':
+				raise CalledProcessError(1, ['adb']+args, str(e).encode())
+		# Anything else (backup, or a server that is not running yet) goes to the binary
+		return AdbTransport.check_output(self, args, timeout)
+
+	def stream(self, args):
+		serial, cmd = (args[1], args[2:]) if args[:1] == ['-s'] else (None, args)
+		if cmd[0] not in ('shell', 'exec-out'):
+			return AdbTransport.stream(self, args)
+		try:
+			sock = self.open_service(serial, ('shell:' if cmd[0] == 'shell' else 'exec:')+' '.join(cmd[1:]), args)
+		except (CalledProcessError, socket.error):
+			return SocketStream(None)
+		return SocketStream(sock)
+
+	# Sync RECV: DATA blocks until DONE, or FAIL with a message
+	def pull(self, serial, remote, local, args):
+		with self.lock:
+			idle = self.sync_idle.setdefault(serial, [])
+			sock = idle.pop() if idle else None
+		if sock == None:
+			sock = self.open_service(serial, 'sync:', args)
+		try:
+			remote = remote.encode('UTF-8')
+			sock.sendall(b'RECV'+pack('<I', len(remote))+remote)
+			with open(local, 'wb') as file_h:
+				while True:
+					block, length = unpack('<4sI', recv_exact(sock, 8))
+					if block == b'DATA':
+						file_h.write(recv_exact(sock, length))
+					elif block == b'DONE':
+						break
+					else:
+						msg = recv_exact(sock, length) if block == b'FAIL' else block
+						raise CalledProcessError(1, ['adb']+args, msg)
+		except:
+			sock.close()	# a failed sync session is not reused
+			if os.path.isfile(local):
+				os.remove(local)
+			raise
+		with self.lock:
+			self.sync_idle[serial].append(sock)
+
+def recv_exact(sock, size):
+	data = b''
+	while len(data) < size:
+		chunk = sock.recv(size-len(data))
+		if not chunk:
+			raise socket.error('adb server closed the connection')
+		data += chunk
+	return data
+
+# A shell or exec service read until the device closes it; None when the
+# service was refused, which looks like an adb call that failed
+class SocketStream:
+	def __init__(self, sock):
+		self.sock = sock
+		self.stdout = sock.makefile('rb') if sock else BytesIO(b'')
+
+	def wait(self):
+		if self.sock == None:
+			return 1
+		self.sock.close()
+		return 0
+
+def make_transport():
+	if ARGS.replay:
+		return AdbReplayer(ARGS.replay, ARGS.replay_latency, ARGS.replay_bandwidth*1048576)
+	inner = AdbSocketTransport() if ARGS.transport == 'socket' else AdbTransport()
+	if ARGS.record:
+		return AdbRecorder(ARGS.record, inner)
+	return inner
+
+TRANSPORT = AdbTransport()
+OUTPUT = ''	# case folder, set by device_info()
+
+# Run adb against the device being acquired
+def adb_co(args, timeout=None):
+	return TRANSPORT.check_output(['-s', ADB_SER] + args, timeout)
+
+def adb_stream(args):
+	return TRANSPORT.stream(['-s', ADB_SER] + args)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# DEVICE PROBES
+#
+# Every probe is one adb call; probe_device() runs them all at once and
+# parses the answers into a DeviceProfile
+SIM_LOC = '/data/system/SimCard.dat'
+PROBES = [
+('id', ['shell', 'id']),
+('su', ['shell', 'su', '-c', 'id']),
+('getprop', ['shell', 'getprop']),
+('build.prop', ['shell', 'cat', '/system/build.prop']),
+('iphonesubinfo', ['shell', 'dumpsys', 'iphonesubinfo']),
+('wifi', ['shell', 'dumpsys', 'wifi']),
+('date', ['shell', "date '+%F %T %Z'"]),
+('sim', ['shell', '[ -f {0} ] && cat {0}'.format(SIM_LOC)]),
+('account', ['shell', 'dumpsys', 'account']),
+]
+SIM_KEYS = [
+('CurrentSimSerialNumber', 'SIM ICCID'),
+('CurrentSimPhoneNumber', 'SIM MSISDN'),
+('CurrentSimOperatorName', 'SIM Operator'),
+('PreviousSimSerialNumber', 'SIM ICCID (Previous)'),
+('PreviousSimPhoneNumber', 'SIM MSISDN (Previous)'),
+]
+DeviceProfile = namedtuple('DeviceProfile', 'perm props manufacturer model imei android_version sdk build_id wifi_mac android_time sim accounts')
+
+# Output of one probe, None if it failed or ran out of time
+def run_probe(args):
+	try:
+		return adb_co(args, timeout=ARGS.probe_timeout).decode('UTF-8', 'replace').replace('\r', '')
+	except TimeoutExpired:
+		ERRORS.append('Device probe \'{0}\' timed out after {1} seconds.'.format(' '.join(args[1:]), ARGS.probe_timeout))
+	except CalledProcessError:
+		pass
+	return None
+
+# System properties, from 'getprop' ([key]: [value]) or build.prop (key=value)
+def parse_props(text):
+	props = {}
+	for line in (text or '').split('\n'):
+		hit = re.match(r'\[(.+?)\]: \[(.*)\]$', line) or re.match(r'([^#=\s][^=]*)=(.*)$', line.strip())
+		if hit:
+			props[hit.group(1).strip()] = hit.group(2).strip()
+	return props
+
+def probe_device():
+	with ThreadPoolExecutor(max_workers=len(PROBES)) as pool:
+		jobs = [(name, pool.submit(run_probe, args)) for name, args in PROBES]
+		out = dict((name, job.result()) for name, job in jobs)
+	# Permissions
+	if 'root' in (out['id'] or ''):
+		perm = 'root'
+	elif 'root' in (out['su'] or ''):
+		perm = 'root(su)'
 	else:
-		PERM = 'shell'
-try:
+		perm = 'shell'
+	# Properties, live values win over build.prop
+	props = parse_props(out['build.prop'])
+	props.update(parse_props(out['getprop']))
+	try:
+		sdk = int(props.get('ro.build.version.sdk', 0))	# 'adb exec-out' needs 21 (Android 5.0) or newer
+	except ValueError:
+		sdk = 0
+	# IMEI
+	imei = ''
+	for line in (out['iphonesubinfo'] or '').split('\n'):
+		if 'Device ID' in line and ' = ' in line:
+			imei = line.split(' = ')[1].strip(); break
+	# Wifi
+	wifi_mac, dumpsys_w = '', out['wifi'] or ''
+	if 'MAC:' in dumpsys_w:
+		wifi_beg = dumpsys_w.index('MAC:')+5
+		if dumpsys_w[wifi_beg:].find(',') == 17:
+			wifi_mac = dumpsys_w[wifi_beg:wifi_beg+17].lower()
+	# Time
+	android_time = out['date'].replace('\n', '') if out['date'] else None
+	# SIM card
+	sim = None
+	if out['sim']:
+		sim = []
+		for sim_d in out['sim'].split('\n'):
+			for sim_key, sim_label in SIM_KEYS:
+				if sim_key in sim_d:
+					sim_val = sim_d.split('=')[1]
+					if sim_val != '' and sim_val != 'null':
+						sim.append([sim_label, sim_val])
+	# Accounts
+	accounts = []
+	for acc in re.finditer(r'Account \{name=(.*?), type=(.*?)\}', out['account'] or ''):
+		accounts.append(acc.group(2)+": "+acc.group(1))
+	return DeviceProfile(perm, props, props.get('ro.product.manufacturer', '').upper(), props.get('ro.product.model', ''), imei,
+		props.get('ro.build.version.release', ''), sdk, props.get('ro.build.display.id', ''), wifi_mac, android_time, sim, accounts)
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# Unrooted (shell) devices, to print device information, limited extractions 
+#
+def device_info(serial=None):
+	global ADB_SER, PERM, DEVICE_MANUF, DEVICE_MODEL, IMEI, ANDROID_VER, ANDROID_SDK, LOCAL_TIME, OUTPUT, REP_HEADER
+	#print('{0:\u00B0^60}'.format(' General Device Information '))
+	print('{0:\u00B0^60}'.format(' General Device Information '))
+
+	# Check for connected Android device
+	ADB_DEV = [] if serial == None else ['-s', serial]
+	try:
+		ADB_STATE = TRANSPORT.check_output(ADB_DEV + ['get-state']).decode('UTF-8')
+	except:
+		ADB_STATE = 'unknown'
+	if 'unknown' in ADB_STATE:
+		die(" No Android device found!")
+	else:
+		ADB_SER = TRANSPORT.check_output(ADB_DEV + ['get-serialno']).decode('UTF-8').replace('\n', '').replace('\r', '')
+		print(" ADB serial: " + ADB_SER); REPORT.append(["ADB serial", ADB_SER])
+
+	# Probe the device, all at once
+	PROFILE = probe_device()
+	PERM = PROFILE.perm
 	print(" Shell permissions: " + PERM); REPORT.append(["Shell permissions", PERM])
-except NameError:
-	input("  Android permission cannot be established!\n Press 'Enter' to exit."); sys.exit()
-
-# Make & Model
-BUILDPROP = co([ADB, 'shell', 'cat', '/system/build.prop']).decode('UTF-8')
-for manuf in BUILDPROP.split('\n'):
-	if 'ro.product.manufacturer' in manuf:
-		DEVICE_MANUF = manuf.strip().split('=')[1].upper()
-for model in BUILDPROP.split('\n'):
-	if 'ro.product.model' in model:
-		DEVICE_MODEL = model.strip().split('=')[1]
-try:
-	print(" Device model: {0} {1}".format(DEVICE_MANUF, DEVICE_MODEL))
-	REPORT.append(["Manufacturer", DEVICE_MANUF]); REPORT.append(["Model", DEVICE_MODEL])
-except:
-	pass; ERRORS.append('Cannot get make and model.')
-
-# IMEI
-for _ in co([ADB, 'shell', 'dumpsys', 'iphonesubinfo']).decode('UTF-8').split('\n'):
-	if 'Device ID' in _:
-		IMEI = _.split(' = ')[1]; break
-try:
-	print(" IMEI: " + IMEI); REPORT.append(["IMEI", IMEI])
-except:
-	pass; ERRORS.append('Cannot get IMEI or IMEI is not supported.')
-
-# A version
-for aver in BUILDPROP.split('\n'):
-	if 'ro.build.version.release' in aver:
-		ANDROID_VER = aver.strip().split('=')[1]
-try:
-	print(" Android version: " + ANDROID_VER); REPORT.append(["Android version", ANDROID_VER])
-except:
-	pass; ERRORS.append('Cannot get Android version.')
-
-# Build ID
-for buildid in BUILDPROP.split('\n'):
-	if 'ro.build.display.id' in buildid:
-		BUILD_ID = buildid.strip().split('=')[1]
-try:
-	print(" Build number: " + BUILD_ID); REPORT.append(["Build name", BUILD_ID])
-except:
-	pass; ERRORS.append('Cannot get Build ID.')
 
-# Wifi
-DUMPSYS_W = co([ADB, 'shell', 'dumpsys', 'wifi']).decode('UTF-8')
-try:
-	wifi_beg = DUMPSYS_W.index('MAC:')+5
-	wifi_end = DUMPSYS_W[wifi_beg:].index(',')
-	if wifi_end == 17:
-		WIFI_MAC = DUMPSYS_W[wifi_beg:wifi_beg+wifi_end].lower()
-		print(" Wi-fi MAC: " + WIFI_MAC); REPORT.append(["Wifi MAC", WIFI_MAC])
-except:
-	pass; ERRORS.append('Wifi is not enabled, or is not supported by the device.')
-
-# Time and date
-LOCAL_TIME = time.strftime('%Y-%m-%d %H:%M:%S %Z')
-try:
+	# Make & Model
+	DEVICE_MANUF, DEVICE_MODEL = PROFILE.manufacturer, PROFILE.model
+	if DEVICE_MANUF and DEVICE_MODEL:
+		print(" Device model: {0} {1}".format(DEVICE_MANUF, DEVICE_MODEL))
+		REPORT.append(["Manufacturer", DEVICE_MANUF]); REPORT.append(["Model", DEVICE_MODEL])
+	else:
+		ERRORS.append('Cannot get make and model.')
+
+	# IMEI
+	IMEI = PROFILE.imei
+	if IMEI:
+		print(" IMEI: " + IMEI); REPORT.append(["IMEI", IMEI])
+	else:
+		ERRORS.append('Cannot get IMEI or IMEI is not supported.')
+
+	# A version
+	ANDROID_VER, ANDROID_SDK = PROFILE.android_version, PROFILE.sdk
+	if ANDROID_VER:
+		print(" Android version: " + ANDROID_VER); REPORT.append(["Android version", ANDROID_VER])
+	else:
+		ERRORS.append('Cannot get Android version.')
+
+	# Build ID
+	if PROFILE.build_id:
+		print(" Build number: " + PROFILE.build_id); REPORT.append(["Build name", PROFILE.build_id])
+	else:
+		ERRORS.append('Cannot get Build ID.')
+
+	# Wifi
+	if PROFILE.wifi_mac:
+		print(" Wi-fi MAC: " + PROFILE.wifi_mac); REPORT.append(["Wifi MAC", PROFILE.wifi_mac])
+	else:
+		ERRORS.append('Wifi is not enabled, or is not supported by the device.')
+
+	# Time and date
+	LOCAL_TIME = time.strftime('%Y-%m-%d %H:%M:%S %Z')
 	print(" Local time: " + LOCAL_TIME); REPORT.append(["Local time", LOCAL_TIME])
-except:
-	pass; ERRORS.append('Cannot get local (Computer) time.')
-ANDROID_TIME = co([ADB, 'shell', 'date', '+%F %T %Z']).decode('UTF-8').replace('\r\n', '')
-try:
-	print(" Android time: " + ANDROID_TIME); REPORT.append(["Android time", ANDROID_TIME])
-except:
-	pass; ERRORS.append('Cannot get remote (Android) time.')
+	if PROFILE.android_time != None:
+		print(" Android time: " + PROFILE.android_time); REPORT.append(["Android time", PROFILE.android_time])
+	else:
+		ERRORS.append('Cannot get remote (Android) time.')
 
-# SIM card extraction 
-SIM_LOC = '/data/system/SimCard.dat'
-if co([ADB, 'shell', '"ls', SIM_LOC+'"']).decode('UTF-8').replace('\r', '').replace('\n', '') == SIM_LOC:
-	SIM_DATA = co([ADB, 'shell', '"cat', SIM_LOC+'"']).decode('UTF-8').replace('\r', '')
-	for sim_d in SIM_DATA.split('\n'):
-		if 'CurrentSimSerialNumber' in sim_d:
-			SIM_ICCID = sim_d.split('=')[1]
-			if SIM_ICCID != '' and SIM_ICCID != 'null':
-				REPORT.append(['SIM ICCID', SIM_ICCID])
-		if 'CurrentSimPhoneNumber' in sim_d:
-			SIM_MSISDN = sim_d.split('=')[1]
-			if SIM_MSISDN != '' and SIM_MSISDN != 'null':
-				REPORT.append(['SIM MSISDN', SIM_MSISDN])
-		if 'CurrentSimOperatorName' in sim_d:
-			SIM_OP = sim_d.split('=')[1]
-			if SIM_OP != '' and SIM_OP != 'null':
-				REPORT.append(['SIM Operator', SIM_OP])
-		if 'PreviousSimSerialNumber' in sim_d:
-			PRV_SIM_ICCID = sim_d.split('=')[1]
-			if PRV_SIM_ICCID != '' and PRV_SIM_ICCID != 'null':
-				REPORT.append(['SIM ICCID (Previous)', PRV_SIM_ICCID])
-		if 'PreviousSimPhoneNumber' in sim_d:
-			PRV_SIM_MSISDN = sim_d.split('=')[1]
-			if PRV_SIM_MSISDN != '' and PRV_SIM_MSISDN != 'null':
-				REPORT.append(['SIM MSISDN (Previous)', PRV_SIM_MSISDN])
-else:
-	ERRORS.append('SIM details are not available.')
-
-# Accounts
-ALLACC = co([ADB, 'shell', 'dumpsys', 'account']).decode('UTF-8')
-all_acc = re.compile('Account {name=', re.DOTALL).finditer(ALLACC)
-ACCOUNTS = []
-for acc in all_acc:
-	hit_pos = acc.start()
-	tacc = ALLACC[hit_pos+14:]
-	end_pos = tacc.index('}')
-	acc0 = tacc[:end_pos].replace(' type=', '').split(',')
-	acc = acc0[1]+": "+acc0[0]
-	ACCOUNTS.append(acc)
-if ACCOUNTS != []:
-	print('{0:\u00B0^60}'.format(' Synchronised Accounts '))
-	for account in ACCOUNTS:
-		print(str(account))
-	REPORT.append(["Accounts", ACCOUNTS])
-else:
-	ERRORS.append('No synchronised accounts were detected.')
+	# SIM card extraction 
+	if PROFILE.sim != None:
+		REPORT.extend(PROFILE.sim)
+	else:
+		ERRORS.append('SIM details are not available.')
 
-# Create output directory
-OR_DATE = time.strftime('%Y-%m-%d')
-OR_TIME = time.strftime('%H.%M.%S')
-OUTPUT = re.sub(r'\s', '', DEVICE_MANUF)+"_"+re.sub(r'\s', '', DEVICE_MODEL)+"_"+OR_DATE+"_"+OR_TIME+SEP
-try:
-	os.mkdir(OUTPUT)
-	os.mkdir(OUTPUT+'db')
-except:
-	input(" Insufficient permissions to create a folder in this directory!\n Press 'Enter' to exit.")
-	sys.exit()
+	# Accounts
+	if PROFILE.accounts != []:
+		print('{0:\u00B0^60}'.format(' Synchronised Accounts '))
+		for account in PROFILE.accounts:
+			print(str(account))
+		REPORT.append(["Accounts", PROFILE.accounts])
+	else:
+		ERRORS.append('No synchronised accounts were detected.')
+
+	# Create output directory
+	OR_DATE = time.strftime('%Y-%m-%d')
+	OR_TIME = time.strftime('%H.%M.%S')
+	OUTPUT = re.sub(r'\s', '', DEVICE_MANUF)+"_"+re.sub(r'\s', '', DEVICE_MODEL)+"_"+OR_DATE+"_"+OR_TIME
+	if ARGS.all_devices:	# same models acquired in the same second must not share a folder
+		OUTPUT += "_"+re.sub(r'[^\w.-]', '-', ADB_SER)
+	OUTPUT += SEP
+	try:
+		os.mkdir(OUTPUT)
+		os.mkdir(OUTPUT+'db')
+	except:
+		die(" Insufficient permissions to create a folder in this directory!")
+
+	REP_HEADER = '<!DOCTYPE html><html><head><meta charset="UTF-8">\n<title>{{_title}} Andriller Report for {_imei}</title>\n<style>body,td,tr {{{{font-family: Vernada, Arial, sans-serif; font-size: 12px;}}}}</style></head>\n<body>\n<a href="REPORT.html">[Back]</a>\n<p align="center"><i># This report was generated using Andriller on {_time} #</i></p>\n<h3 align="center">[{{_title}}] {_imei}</h3>\n'.format(_imei=IMEI, _time=LOCAL_TIME)	# REP_HEADER.format(_title=rep_title)
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # ROOT EXTRACTION
@@ -320,177 +762,1259 @@ AB_DBLS = [
 
 #
 # DOWNLOADING DATABASES
-SUC, QM, DLT = '', '', '/data/local/tmp/'
-if 'su' in PERM:	SUC, QM = 'su -c', '"'
+DLT = '/data/local/tmp/'
+DL_SEQ = count()	# unique names for files staged in DLT
+DL_LOCK = Lock()	# guards DLLS and the checksum files while pulling concurrently
+HASH_CHUNK = 1048576	# bytes copied and hashed at a time
+MEM_DBS = {}	# --in-memory: artifact name -> bytes, decoded without going through OUTPUT/db
+PERSISTS = []	# --in-memory: evidence copies being written in the background
+PERSIST_POOL = ThreadPoolExecutor(max_workers=1)
 #
 DLLS = []	# downloaded databases empty list
-def download_database(DB_PATH):
-	DB_NAME, DB_PATHa = DB_PATH.split('/')[-1], DB_PATH
+DL_HASHES = {}	# local name: hex digests
+DL_PATHS = {}	# local name: remote path, for on-device verification
+DL_REUSED = []	# local names reused from a previous case
+DL_REMOTE = {}	# remote path: (size, mtime) from stat_remote(), to check exec-out pulls
+
+# Quote a string for the device shell
+def sh_quote(s):
+	return "'" + s.replace("'", "'\\''") + "'"
+
+# Wrap a device shell command line for root access
+def root_cmd(cmd):
+	if 'su' in PERM:
+		return 'su -c ' + sh_quote(cmd)
+	return cmd
+
+# Copy a stream to dst (if given) in fixed-size chunks, hashing it on the way.
+# SHA-1 is only kept for devices that have sha1sum but no md5sum.
+def copy_hashed(src, dst=None):
+	hashes = (('md5', md5()), ('sha1', sha1()), ('sha256', sha256()))
+	for chunk in iter(lambda: src.read(HASH_CHUNK), b''):
+		for _, h in hashes:
+			h.update(chunk)
+		if dst != None:
+			dst.write(chunk)
+	return dict((algo, h.hexdigest()) for algo, h in hashes)
+
+def hash_file(path):
+	with open(path, 'rb') as file_h:
+		return copy_hashed(file_h)
+
+# Register a downloaded file and its checksums
+def record_download(DB_NAME, DB_HASH, DB_PATH=None):
+	with DL_LOCK:
+		DLLS.append(DB_NAME)
+		DL_HASHES[DB_NAME] = DB_HASH
+		if DB_PATH != None:
+			DL_PATHS[DB_NAME] = DB_PATH
+		for algo in ('md5', 'sha256'):
+			with open(OUTPUT+'db'+SEP+'checksums.'+algo, 'a') as sumfile:
+				sumfile.write(DB_HASH[algo]+'\t'+str(DB_NAME)+'\n')
+
+# Put DLLS and the checksum files back into the given order of names;
+# names from earlier stages stay in front, as they were
+def sort_downloads(DB_NAMES):
+	order = lambda DB_NAME: DB_NAMES.index(DB_NAME) if DB_NAME in DB_NAMES else -1
+	DLLS.sort(key=order)
+	for algo in ('md5', 'sha256'):
+		if os.path.isfile(OUTPUT+'db'+SEP+'checksums.'+algo):
+			with open(OUTPUT+'db'+SEP+'checksums.'+algo, 'r') as sumfile:
+				sums = sumfile.readlines()
+			sums.sort(key=lambda _: order(_.rstrip('\n').split('\t')[1]))
+			with open(OUTPUT+'db'+SEP+'checksums.'+algo, 'w') as sumfile:
+				sumfile.writelines(sums)
+
+def download_database(DB_PATH, errors=ERRORS):
+	DB_NAME = DB_PATH.split('/')[-1]
 	if DB_NAME not in DLLS:
-		if ' ' in DB_NAME:	DB_PATHa = DB_PATH.replace(DB_NAME, repr(DB_NAME))
-		if co([ADB, 'shell', SUC, QM+'ls', repr(DB_PATHa)+QM]).decode('UTF-8').replace('\r', '').replace('\n', '') == DB_PATH:
-			if 'su' in PERM:
-				co([ADB, 'shell', SUC, QM+'dd', 'if='+repr(DB_PATHa), 'of='+repr(DLT+repr(DB_NAME))+QM])
-				co([ADB, 'shell', SUC, QM+'chmod', '777', repr(DLT+repr(DB_NAME))+QM])
-				co([ADB, 'pull', DLT+str(DB_NAME), OUTPUT+'db'+SEP+str(DB_NAME)])
-				co([ADB, 'shell', SUC, QM+'rm', repr(DLT+repr(DB_NAME))+QM])
+		if adb_co(['shell', root_cmd('ls '+sh_quote(DB_PATH))]).decode('UTF-8').replace('\r', '').replace('\n', '') == DB_PATH:
+			DB_HASH, size = None, DL_REMOTE.get(DB_PATH, (None, None))[0]
+			# 'exec-out' is binary safe, so the bytes are hashed as they arrive.
+			# It mixes stderr into the data and does not pass back the remote
+			# exit status, so it is only used when stat gave a size to check
+			# the byte count against; otherwise the file goes by dd and pull
+			if ANDROID_SDK >= 21 and size != None:
+				with TRANSFERS, open(OUTPUT+'db'+SEP+str(DB_NAME), 'wb') as file_h:
+					proc = adb_stream(['exec-out', root_cmd('cat '+sh_quote(DB_PATH)+' 2>/dev/null')])
+					DB_HASH = copy_hashed(proc.stdout, file_h)
+					proc.stdout.close()
+					copied = file_h.tell()
+					if proc.wait() != 0 or copied != size:
+						DB_HASH = None
+				if DB_HASH == None:
+					os.remove(OUTPUT+'db'+SEP+str(DB_NAME))
+					errors.append('Failed pulling {0} file from the device ({1} of {2} bytes arrived).'.format(DB_NAME, copied, size))
+					return
+			elif 'su' in PERM:
+				DB_TMP = DLT+'andriller-{0}-{1}'.format(os.getpid(), next(DL_SEQ))
+				adb_co(['shell', root_cmd('dd if={0} of={1}'.format(sh_quote(DB_PATH), DB_TMP))])
+				adb_co(['shell', root_cmd('chmod 777 '+DB_TMP)])
+				with TRANSFERS:
+					adb_co(['pull', DB_TMP, OUTPUT+'db'+SEP+str(DB_NAME)])
+				adb_co(['shell', root_cmd('rm '+DB_TMP)])
 			else:
-				co([ADB, 'pull', DB_PATH, OUTPUT+'db'+SEP+str(DB_NAME)])
+				with TRANSFERS:
+					adb_co(['pull', DB_PATH, OUTPUT+'db'+SEP+str(DB_NAME)])
 			if os.path.isfile(OUTPUT+'db'+SEP+str(DB_NAME)) == True:
-				DB_MD5 = md5(open(OUTPUT+'db'+SEP+str(DB_NAME), 'rb').read()).hexdigest()
-				DLLS.append(DB_NAME)
-				with open(OUTPUT+'db'+SEP+'checksums.md5', 'a') as md5file:
-					md5file.write(DB_MD5+'\t'+str(DB_NAME)+'\n')
+				if DB_HASH == None:
+					DB_HASH = hash_file(OUTPUT+'db'+SEP+str(DB_NAME))
+				record_download(DB_NAME, DB_HASH, DB_PATH)
 			else:
-				ERRORS.append('Failed pulling {0} file from the device.'.fformat(DB_NAME))
+				errors.append('Failed pulling {0} file from the device.'.format(DB_NAME))
+		else:
+			errors.append('Remote file {0} is not present on the device.'.format(DB_NAME))
+
+# Pull files with a bounded pool of workers. Paths sharing a local name go
+# to the same worker in order, so the first present one still wins; errors,
+# DLLS and checksums.md5 end up in DB_PATHS order whatever finishes first.
+def download_databases_pool(DB_PATHS, workers):
+	groups = OrderedDict()
+	for DB_PATH in DB_PATHS:
+		groups.setdefault(DB_PATH.split('/')[-1], []).append(DB_PATH)
+	def pull_group(paths):
+		errors = []
+		for DB_PATH in paths:
+			download_database(DB_PATH, errors)
+		return errors
+	with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+		for errors in pool.map(pull_group, groups.values()):
+			ERRORS.extend(errors)
+	sort_downloads(list(groups))
+
+# Stream all present files in one 'tar' over 'adb exec-out', rooted devices only
+def download_databases_tar(DB_PATHS):
+	check = 'for f in {0}; do [ -f "$f" ] && echo "$f"; done'.format(' '.join(map(sh_quote, DB_PATHS)))
+	present = adb_co(['shell', root_cmd(check)]).decode('UTF-8').replace('\r', '').split('\n')
+	targets = {}	# remote path: local name, first present path wins a name
+	for DB_PATH in DB_PATHS:
+		DB_NAME = DB_PATH.split('/')[-1]
+		if DB_NAME in DLLS or DB_NAME in targets.values():
+			continue
+		if DB_PATH in present:
+			targets[DB_PATH] = DB_NAME
 		else:
 			ERRORS.append('Remote file {0} is not present on the device.'.format(DB_NAME))
+	if targets == {}:
+		return
+	# exec-out has no separate stderr, so tar gets relative paths (no "removing
+	# leading '/'" warning) and anything else it says goes to /dev/null, or it
+	# would land in front of the tar data
+	tar_cmd = 'tar -cf - -C / ' + ' '.join(sh_quote(_.lstrip('/')) for _ in targets) + ' 2>/dev/null'
+	TRANSFERS.acquire()
+	try:
+		proc = adb_stream(['exec-out', root_cmd(tar_cmd)])
+		try:
+			with tarfile.open(fileobj=proc.stdout, mode='r|') as tar_h:
+				for tar_item in tar_h:
+					DB_PATH = '/' + tar_item.name.lstrip('/')
+					if not tar_item.isfile() or DB_PATH not in targets or targets[DB_PATH] in DLLS:
+						continue
+					DB_NAME = targets[DB_PATH]
+					with open(OUTPUT+'db'+SEP+DB_NAME, 'wb') as file_h:
+						DB_HASH = copy_hashed(tar_h.extractfile(tar_item), file_h)
+					record_download(DB_NAME, DB_HASH, DB_PATH)
+		except (tarfile.TarError, OSError) as e:
+			ERRORS.append('The tar stream from the device failed ({0}), the rest of the files are pulled one by one.'.format(e))
+		finally:
+			proc.stdout.close()
+			proc.wait()
+	finally:
+		TRANSFERS.release()
+	# Anything the stream did not deliver is pulled one by one
+	download_databases_pool([_ for _ in targets if targets[_] not in DLLS], ARGS.workers)
+
+# Hash remote files with md5sum (or sha1sum) on the device, in one shell call
+def device_hashes(DB_PATHS):
+	for tool, algo in (('md5sum', 'md5'), ('sha1sum', 'sha1')):
+		cmd = tool+' '+' '.join(map(sh_quote, DB_PATHS))
+		sums = {}
+		for line in adb_co(['shell', root_cmd(cmd)]).decode('UTF-8', 'replace').replace('\r', '').split('\n'):
+			hit = re.match(r'([0-9a-f]{32,40}) [ *](.+)$', line)
+			if hit:
+				sums[hit.group(2)] = hit.group(1)
+		if sums != {}:
+			return tool, algo, sums
+	return None, None, {}
+
+# Remote size and mtime of the present files, in one shell call
+def stat_remote(DB_PATHS):
+	remote = {}
+	cmd = 'stat -c "%s %Y %n" '+' '.join(map(sh_quote, DB_PATHS))
+	for line in adb_co(['shell', root_cmd(cmd)]).decode('UTF-8', 'replace').replace('\r', '').split('\n'):
+		hit = re.match(r'(\d+) (\d+) (/.+)$', line)
+		if hit:
+			remote[hit.group(3)] = (int(hit.group(1)), int(hit.group(2)))
+	return remote
+
+# Compare the host digests with md5sum (or sha1sum) run on the device itself
+def verify_downloads():
+	DB_NAMES = [_ for _ in DLLS if _ in DL_PATHS]
+	if DB_NAMES == []:
+		return
+	tool, algo, sums = device_hashes([DL_PATHS[_] for _ in DB_NAMES])
+	if sums == {}:
+		ERRORS.append('Neither md5sum nor sha1sum is available on the device, acquisition was not verified.')
+		return
+	verified = 0
+	for DB_NAME in DB_NAMES:
+		DEV_HASH = sums.get(DL_PATHS[DB_NAME])
+		if DEV_HASH == DL_HASHES[DB_NAME][algo]:
+			verified += 1
+		elif DEV_HASH == None:
+			ERRORS.append('{0} could not be hashed on the device.'.format(DB_NAME))
+		else:
+			ERRORS.append('{0} does not match the on-device {1} ({2} on device, {3} pulled).'.format(DB_NAME, tool, DEV_HASH, DL_HASHES[DB_NAME][algo]))
+	print(' Verified {0} of {1} files against on-device {2}.'.format(verified, len(DB_NAMES), tool))
+	REPORT.append(['Acquisition verified', '{0} of {1} files ({2} on device)'.format(verified, len(DB_NAMES), tool)])
+
+# Remote path: size, mtime and digests of a case's files, from its db/manifest.tsv
+MANIFEST_COLS = ('name', 'path', 'size', 'mtime', 'md5', 'sha1', 'sha256', 'source')
+def read_manifest(CASE_DB):
+	entries = {}
+	if os.path.isfile(CASE_DB+'manifest.tsv'):
+		with open(CASE_DB+'manifest.tsv', 'r', encoding='UTF-8') as manfile:
+			for line in manfile.readlines()[1:]:
+				entry = dict(zip(MANIFEST_COLS, line.rstrip('\n').split('\t')))
+				if entry.get('path'):
+					entries[entry['path']] = entry
+	return entries
+
+def write_manifest(remote):
+	with open(OUTPUT+'db'+SEP+'manifest.tsv', 'w', encoding='UTF-8') as manfile:
+		manfile.write('\t'.join(MANIFEST_COLS)+'\n')
+		for DB_NAME in DLLS:
+			DB_PATH = DL_PATHS.get(DB_NAME, '')
+			size, mtime = remote.get(DB_PATH, ('', ''))
+			source = 'reused' if DB_NAME in DL_REUSED else 'pulled'
+			row = (DB_NAME, DB_PATH, size, mtime, DL_HASHES[DB_NAME]['md5'], DL_HASHES[DB_NAME]['sha1'], DL_HASHES[DB_NAME]['sha256'], source)
+			manfile.write('\t'.join(map(str, row))+'\n')
+
+# Take files unchanged since a previous case (same remote size, mtime and
+# on-device hash) from that case's folder, so only changed ones cross USB
+def reuse_previous(CASE, DB_PATHS, remote):
+	CASE_DB = CASE.rstrip('/\\')+SEP+'db'+SEP
+	prev = read_manifest(CASE_DB)
+	if prev == {}:
+		ERRORS.append('No manifest.tsv in {0}, nothing was reused.'.format(CASE))
+		return
+	if remote == {}:
+		ERRORS.append('Remote file sizes and times are not available (no stat), nothing was reused.')
+		return
+	winners, names = [], []	# the first present path of each name, as in a full pull
+	for DB_PATH in DB_PATHS:
+		DB_NAME = DB_PATH.split('/')[-1]
+		if DB_PATH in remote and DB_NAME not in names and DB_NAME not in DLLS:
+			names.append(DB_NAME)
+			if DB_PATH in prev and remote[DB_PATH] == (int(prev[DB_PATH]['size'] or -1), int(prev[DB_PATH]['mtime'] or -1)):
+				winners.append(DB_PATH)
+	if winners == []:
+		return
+	tool, algo, sums = device_hashes(winners)
+	for DB_PATH in winners:
+		entry, DB_NAME = prev[DB_PATH], DB_PATH.split('/')[-1]
+		if sums.get(DB_PATH) == None or sums[DB_PATH] != entry[algo] or not os.path.isfile(CASE_DB+entry['name']):
+			continue
+		try:
+			os.link(CASE_DB+entry['name'], OUTPUT+'db'+SEP+DB_NAME)
+		except OSError:
+			shutil.copy2(CASE_DB+entry['name'], OUTPUT+'db'+SEP+DB_NAME)
+		DB_HASH = hash_file(OUTPUT+'db'+SEP+DB_NAME)
+		if DB_HASH['md5'] != entry['md5']:	# the earlier copy is not intact, pull it again
+			os.remove(OUTPUT+'db'+SEP+DB_NAME)
+			ERRORS.append('{0} in {1} does not match its manifest, pulled again.'.format(entry['name'], CASE))
+			continue
+		DL_REUSED.append(DB_NAME)
+		record_download(DB_NAME, DB_HASH, DB_PATH)
+	print(' Reused {0} unchanged files from {1}.'.format(len(DL_REUSED), CASE))
 
 # Extract databases from AB
+# backup.ab: 'ANDROID BACKUP', version, compressed flag and encryption
+# name on separate lines, then the (encrypted, deflated) tar of the backup
+def read_ab_header(file_h):
+	if file_h.readline() != b'ANDROID BACKUP\n':
+		raise ValueError('not an Android backup file')
+	version = int(file_h.readline())
+	compressed = file_h.readline().strip() == b'1'
+	encryption = file_h.readline().strip().decode()
+	return {'version': version, 'compressed': int(compressed), 'encryption': encryption}
+
+# Header read, and the stream of tar data that follows it
+def open_backup(AB_raw):
+	header = read_ab_header(AB_raw)
+	data_h = AB_raw
+	if header['encryption'] == 'AES-256':
+		data_h = DecryptStream(AB_raw, unlock_backup(AB_raw, header['version']))
+	elif header['encryption'] != 'none':
+		raise ValueError('unknown encryption {0}'.format(header['encryption']))
+	header['data_start'] = AB_raw.tell()
+	return header, InflateStream(data_h) if header['compressed'] else data_h
+
+def backup_password():
+	if ARGS.ab_password == None:
+		if ARGS.all_devices:
+			raise ValueError('backup is password protected, give the password with --ab-password')
+		ARGS.ab_password = getpass(' Backup password: ')
+	return ARGS.ab_password
+
+# Encrypted backups carry the user key salt, master key checksum salt, PBKDF2
+# rounds, user key IV and the master key blob (IV, key and checksum, each
+# length prefixed, encrypted with the user key), one hex line each
+def unlock_backup(file_h, version):
+	if aes_cbc == None:
+		raise ValueError('backup is password protected, decrypting it needs pycryptodome or cryptography (pip install pycryptodome)')
+	user_salt, ck_salt = unhexlify(file_h.readline().strip()), unhexlify(file_h.readline().strip())
+	rounds = int(file_h.readline())
+	user_iv, mk_blob = unhexlify(file_h.readline().strip()), unhexlify(file_h.readline().strip())
+	password = backup_password().encode('UTF-8' if version >= 2 else 'latin-1')
+	T1 = time.time()	# after the password prompt, so only the derivation is timed
+	user_key = pbkdf2_hmac('sha1', password, user_salt, rounds, 32)
+	blob = aes_cbc(user_key, user_iv)(mk_blob)
+	try:
+		mk_iv = blob[1:1+blob[0]]
+		pos = 1+blob[0]
+		mk = blob[pos+1:pos+1+blob[pos]]
+		pos += 1+blob[pos]
+		ck = blob[pos+1:pos+1+blob[pos]]
+	except IndexError:
+		mk, ck = b'', None
+	# Java hashes the key as chars from signed bytes; from version 2 UTF-8 encoded
+	mk_chars = ''.join(chr(_ if _ < 128 else 0xFF00 | _) for _ in mk).encode('UTF-8') if version >= 2 else mk
+	if ck == None or pbkdf2_hmac('sha1', mk_chars, ck_salt, rounds, 32) != ck:
+		raise ValueError('wrong backup password')
+	print(' Backup key derived in {0:.3f} seconds ({1} PBKDF2 rounds)'.format(time.time()-T1, rounds))
+	return aes_cbc(mk, mk_iv)
+
+# AES-256-CBC with PKCS#7 padding, decrypted a chunk at a time; the last
+# block is held back until the end of the file, where the padding is dropped
+class DecryptStream:
+	def __init__(self, file_h, decrypt):
+		self.file_h, self.decrypt = file_h, decrypt
+		self.raw, self.plain, self.eof = b'', b'', False
+		self.size, self.seconds = 0, 0
+
+	def read(self, size=-1):
+		size = size if size > 0 else HASH_CHUNK
+		while len(self.plain) <= 16 and not self.eof:
+			raw = self.file_h.read(HASH_CHUNK)
+			if not raw:
+				self.eof = True
+				self.plain = self.plain[:-self.plain[-1]] if self.plain else b''
+				break
+			self.raw += raw
+			cut = len(self.raw)//16*16
+			T1 = time.time()
+			self.plain += self.decrypt(self.raw[:cut])
+			self.seconds += time.time()-T1
+			self.size += cut
+			self.raw = self.raw[cut:]
+		size = min(size, len(self.plain) if self.eof else len(self.plain)-16)
+		data, self.plain = self.plain[:size], self.plain[size:]
+		return data
+
+	def report(self):
+		print(' Backup decrypted: {0:.1f} MB in {1:.3f} seconds ({2:.1f} MB/s)'.format(self.size/1048576, self.seconds, self.size/1048576/max(self.seconds, 0.001)))
+
+# Inflates the backup a bounded piece at a time, so memory use does not grow
+# with the size of the backup
+class InflateStream:
+	def __init__(self, file_h):
+		self.file_h, self.inflate, self.eof = file_h, decompressobj(), False
+		self.report = getattr(file_h, 'report', lambda: None)
+
+	def read(self, size=-1):
+		size = size if size > 0 else HASH_CHUNK
+		data = b''
+		while not data and not self.eof:
+			raw = self.inflate.unconsumed_tail or self.file_h.read(HASH_CHUNK)
+			if not raw:
+				self.eof = True
+				return self.inflate.flush()
+			data = self.inflate.decompress(raw, size)
+			self.eof = self.inflate.eof
+		return data
+
+# The catalog is a SQLite file next to the backup, listing every tar member
+# with its offset in the inflated stream, so members can be found and pulled
+# out later without going through the whole backup again
+CATALOG_COLS = ('name', 'size', 'mode', 'mtime', 'offset', 'sha256')
+
+def catalog_path(AB_PATH):
+	return AB_PATH+'.catalog'
+
+# One pass over a backup: every member is catalogued and hashed, and members
+# for which want(name) gives a file name (or a file object) are written there too. Returns the
+# hashes of the written members and a problem (None if the pass completed).
+def scan_backup(AB_PATH, want=lambda name: None):
+	found, problem = {}, None
+	with open(AB_PATH, 'rb') as AB_raw:
+		header, data_h = open_backup(AB_raw)
+		if os.path.isfile(catalog_path(AB_PATH)):
+			os.remove(catalog_path(AB_PATH))
+		CAT = sq.connect(catalog_path(AB_PATH))
+		CAT.execute('CREATE TABLE archive (key TEXT PRIMARY KEY, value)')
+		CAT.execute('CREATE TABLE members ({0})'.format(', '.join(CATALOG_COLS)))
+		AB_stat = os.stat(AB_PATH)
+		CAT.executemany('INSERT INTO archive VALUES (?,?)', list(header.items())+[('size', AB_stat.st_size), ('mtime', int(AB_stat.st_mtime)), ('complete', 0)])
+		try:
+			AB_tar = tarfile.open(fileobj=data_h, mode='r|')
+			for ab_obj in AB_tar:
+				DB_HASH = {}
+				if ab_obj.isfile():
+					DB_FILE = want(ab_obj.name)
+					if isinstance(DB_FILE, str):
+						with open(DB_FILE, 'wb') as file_h:
+							DB_HASH = found[ab_obj.name] = copy_hashed(AB_tar.extractfile(ab_obj), file_h)
+					elif DB_FILE != None:
+						DB_HASH = found[ab_obj.name] = copy_hashed(AB_tar.extractfile(ab_obj), DB_FILE)
+					else:
+						src, DB_HASH['sha256'] = AB_tar.extractfile(ab_obj), sha256()
+						for chunk in iter(lambda: src.read(HASH_CHUNK), b''):
+							DB_HASH['sha256'].update(chunk)
+						DB_HASH['sha256'] = DB_HASH['sha256'].hexdigest()
+				CAT.execute('INSERT INTO members VALUES (?,?,?,?,?,?)', (ab_obj.name, ab_obj.size, ab_obj.mode, ab_obj.mtime, ab_obj.offset_data, DB_HASH.get('sha256')))
+			CAT.execute('UPDATE archive SET value = 1 WHERE key = \'complete\'')
+		except (tarfile.TarError, ZlibError, EOFError) as e:
+			problem = 'Android backup is incomplete or damaged ({0})'.format(e)
+		if hasattr(data_h, 'report'):
+			data_h.report()
+	CAT.execute('CREATE INDEX members_name ON members (name)')
+	CAT.commit()
+	CAT.close()
+	return found, problem
+
+# Catalog of a backup, built first if it is missing or the backup has changed
+def open_catalog(AB_PATH):
+	if os.path.isfile(catalog_path(AB_PATH)):
+		CAT = sq.connect(catalog_path(AB_PATH))
+		archive = dict(CAT.execute('SELECT key, value FROM archive'))
+		AB_stat = os.stat(AB_PATH)
+		if archive.get('size') == AB_stat.st_size and archive.get('mtime') == int(AB_stat.st_mtime):
+			return CAT
+		CAT.close()
+	scan_backup(AB_PATH)
+	return sq.connect(catalog_path(AB_PATH))
+
+# Members whose names match a GLOB pattern, as dicts of CATALOG_COLS
+def query_backup(AB_PATH, pattern='*'):
+	CAT = open_catalog(AB_PATH)
+	rows = CAT.execute('SELECT {0} FROM members WHERE name GLOB ? ORDER BY offset'.format(', '.join(CATALOG_COLS)), (pattern,)).fetchall()
+	CAT.close()
+	return [dict(zip(CATALOG_COLS, row)) for row in rows]
+
+# Writes the given catalog members into dest and returns their hashes. A
+# plain backup is read at the offsets directly; a deflate stream has no
+# random access, so a compressed or encrypted one is read from the start,
+# but only up to the end of the last member asked for.
+# Member names come from the evidence, so any that would land outside dest
+# (absolute, or climbing out with ..) are skipped and logged
+def extract_backup(AB_PATH, members, dest):
+	found, dest_real = {}, os.path.realpath(dest)+os.sep
+	open_catalog(AB_PATH).close()
+	with open(AB_PATH, 'rb') as AB_raw:
+		header, data_h = open_backup(AB_raw)
+		pos, seekable = 0, data_h == AB_raw
+		for member in sorted(members, key=lambda _: _['offset']):
+			if not seekable:
+				while pos < member['offset']:
+					skipped = data_h.read(min(HASH_CHUNK, member['offset']-pos))
+					if not skipped:
+						raise EOFError('backup ends before {0}'.format(member['name']))
+					pos += len(skipped)
+			MEMBER_NAME = posixpath.normpath(member['name'])
+			DB_FILE = os.path.join(dest, *MEMBER_NAME.split('/'))
+			if MEMBER_NAME.startswith('/') or not os.path.realpath(DB_FILE).startswith(dest_real):
+				ERRORS.append('Backup member {0} points outside {1}, not extracted.'.format(member['name'], dest))
+				continue
+			if seekable:
+				AB_raw.seek(header['data_start']+member['offset'])
+			if not os.path.isdir(os.path.dirname(DB_FILE)):
+				os.makedirs(os.path.dirname(DB_FILE))
+			with open(DB_FILE, 'wb') as file_h:
+				found[member['name']] = copy_hashed(BoundedReader(data_h, member['size']), file_h)
+			pos = member['offset']+member['size']
+			if found[member['name']]['sha256'] != member['sha256']:
+				raise ValueError('{0} does not match its catalog entry'.format(member['name']))
+	return found
+
+# Reads no more than size bytes from a stream
+class BoundedReader:
+	def __init__(self, file_h, size):
+		self.file_h, self.left = file_h, size
+
+	def read(self, size=-1):
+		data = self.file_h.read(min(size if size > 0 else HASH_CHUNK, self.left)) if self.left else b''
+		self.left -= len(data)
+		return data
+
+# Members in AB_DBLS are written and hashed during the catalog pass. A name
+# found under several packages keeps the first one in AB_DBLS. With
+# --in-memory they are read into MEM_DBS and written out in the background.
 def android_backup_extractor():
-	AB_raw = open(OUTPUT+'backup.ab', 'rb')
-	AB_tar = tarfile.open(fileobj=BytesIO(decompress(AB_raw.read()[24:])))
-	for ab_item in AB_DBLS:
+	rank, bufs, in_memory = {}, {}, ARGS.in_memory and hasattr(sq.Connection, 'deserialize')
+	if ARGS.in_memory and not in_memory:
+		ERRORS.append('This Python\'s sqlite3 cannot load databases from memory, --in-memory was ignored.')
+	def want(name):
+		if name not in AB_DBLS:
+			return None
+		DB_NAME = name.split('/')[-1]
+		if DB_NAME in DLLS or rank.get(DB_NAME, len(AB_DBLS)) < AB_DBLS.index(name):
+			return None
+		rank[DB_NAME] = AB_DBLS.index(name)
+		if in_memory:
+			bufs[DB_NAME] = BytesIO()
+			return bufs[DB_NAME]
+		return OUTPUT+'db'+SEP+str(DB_NAME)
+	try:
+		found, problem = scan_backup(OUTPUT+'backup.ab', want)
+	except ValueError as e:
+		ERRORS.append('backup.ab cannot be read: {0}'.format(e))
+		return
+	if problem:
+		ERRORS.append(problem+', extracted what was readable.')
+	for name in sorted(found, key=AB_DBLS.index):
+		DB_NAME = name.split('/')[-1]
+		if rank[DB_NAME] == AB_DBLS.index(name):
+			if in_memory:
+				MEM_DBS[DB_NAME] = bufs.pop(DB_NAME).getvalue()
+				if not ARGS.no_db_copy:
+					PERSISTS.append(PERSIST_POOL.submit(persist_db, DB_NAME))
+			record_download(DB_NAME, found[name])
+
+def persist_db(DB_NAME):
+	with open(OUTPUT+'db'+SEP+DB_NAME, 'wb') as file_h:
+		file_h.write(MEM_DBS[DB_NAME])
+
+# Evidence copies of in-memory artifacts have to be on disk before the report
+def persist_wait():
+	for job in PERSISTS:
 		try:
-			ab_obj = AB_tar.getmember(ab_item)
-			DB_NAME = ab_item.split('/')[-1]
-			if DB_NAME not in DLLS:
-				with open(OUTPUT+'db'+SEP+str(DB_NAME), 'wb') as file_h:
-					file_h.write(AB_tar.extractfile(ab_obj).read())
-				if os.path.isfile(OUTPUT+'db'+SEP+str(DB_NAME)) == True:
-					DB_MD5 = md5(open(OUTPUT+'db'+SEP+str(DB_NAME), 'rb').read()).hexdigest()
-					DLLS.append(DB_NAME)
-					with open(OUTPUT+'db'+SEP+'checksums.md5', 'a') as md5file:
-						md5file.write(DB_MD5+'\t'+str(DB_NAME)+'\n')		
-		except:
-			pass
-	del AB_raw,AB_tar
+			job.result()
+		except OSError as e:
+			ERRORS.append('Evidence copy could not be written: {0}'.format(e))
+	del PERSISTS[:]
 
 # Trigger download databases / android_backup
-if 'root' in PERM:
-	print('{0:\u00B0^60}'.format(' Data Extraction via Root '))
-	for db in DBLS:
-		download_database(db)
-else:
-	if int(ANDROID_VER[0]) >= 4:
-		print('{0:\u00B0^60}'.format(' Data Extraction via Android Backup '))
-		print('>>> Extraction via Android Backup method <<<\n>>> Unlock the screen and tap on "Back up my data" <<<')
-		try:
-			co([ADB, 'backup', '-all', '-f', OUTPUT+'backup.ab'])
-		except:
-			pass
-		if os.path.isfile(OUTPUT+'backup.ab'):
-			android_backup_extractor()
-			print(' Success! {0} databases extracted from backup.'.format(len(DLLS)))
+def acquire():
+	if 'root' in PERM:
+		print('{0:\u00B0^60}'.format(' Data Extraction via Root '))
+		remote = stat_remote(DBLS)
+		DL_REMOTE.update(remote)
+		if ARGS.previous:
+			reuse_previous(ARGS.previous, DBLS, remote)
+		if ARGS.tar:
+			download_databases_tar(DBLS)
+		else:
+			download_databases_pool(DBLS, ARGS.workers)
+		sort_downloads([_.split('/')[-1] for _ in DBLS])
+		if ARGS.verify:
+			verify_downloads()
+		write_manifest(remote)
+		if ARGS.previous:
+			REPORT.append(['Artifacts reused', [_ for _ in DLLS if _ in DL_REUSED] or ['none']])
+			REPORT.append(['Artifacts pulled', [_ for _ in DLLS if _ not in DL_REUSED] or ['none']])
+	else:
+		if int(ANDROID_VER[0]) >= 4:
+			print('{0:\u00B0^60}'.format(' Data Extraction via Android Backup '))
+			print('>>> Extraction via Android Backup method <<<\n>>> Unlock the screen and tap on "Back up my data" <<<')
+			try:
+				with TRANSFERS:
+					adb_co(['backup', '-all', '-f', OUTPUT+'backup.ab'])
+			except:
+				pass
+			if os.path.isfile(OUTPUT+'backup.ab'):
+				android_backup_extractor()
+				print(' Success! {0} databases extracted from backup.'.format(len(DLLS)))
+
+# Timestamp to date converters  # # # # # # # # # # # # # # # #
+# Stamps are told apart by size: seconds, milliseconds or microseconds since
+# 1970, or WebKit microseconds since 1601 from 1e16 up (as Unix microseconds
+# that would be after 2286). Formatted seconds are cached, the messages of a
+# store share a lot of them; stamps that are not a date come out blank
+WEBKIT_EPOCH = 11644473600	# seconds from 1601-01-01 to 1970-01-01
+STAMP_ERRORS = (TypeError, ValueError, OverflowError, OSError)
+
+def stamp_seconds(stamp):
+	if type(stamp) is not int:
+		stamp = int(float(stamp))
+	size = abs(stamp)
+	if size < 10**11:
+		return stamp
+	elif size < 10**14:
+		return stamp // 1000
+	elif size < 10**16:
+		return stamp // 1000000
+	return stamp // 1000000 - WEBKIT_EPOCH
+
+@lru_cache(maxsize=65536)
+def utc_seconds(seconds):
+	return '%04d-%02d-%02d %02d:%02d:%02d UTC' % time.gmtime(seconds)[:6]
 
-# Unix timestamp to date converter  # # # # # # # # # # # # # #
 def unix_to_utc(unix_stamp):
-	return datetime.utcfromtimestamp(int(str(unix_stamp)[:10])).strftime('%Y-%m-%d %H:%M:%S UTC')
+	try:
+		return utc_seconds(stamp_seconds(unix_stamp))
+	except STAMP_ERRORS:
+		return ''
 
 def webkit_to_utc(webkit_stamp):
-	wtu0 = (datetime(1601,1,1) + timedelta(microseconds=int(webkit_stamp))).timetuple()
 	try:
-		return unix_to_utc(int(time.mktime(wtu0)))
-	except:
-		return None
+		return utc_seconds(int(webkit_stamp) // 1000000 - WEBKIT_EPOCH)
+	except STAMP_ERRORS:
+		return ''
 
 def escape_html(data):
 	if data != None:
-		return escape(data)
+		return escape(data, quote=False)
 	else:
 		return ''
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 # DECODING DEFINITIONS FOR DATABASES
 # 
-REP_HEADER = '<!DOCTYPE html><html><head><meta charset="UTF-8">\n<title>{{_title}} Andriller Report for {_imei}</title>\n<style>body,td,tr {{{{font-family: Vernada, Arial, sans-serif; font-size: 12px;}}}}</style></head>\n<body>\n<a href="REPORT.html">[Back]</a>\n<p align="center"><i># This report was generated using Andriller on {_time} #</i></p>\n<h3 align="center">[{{_title}}] {_imei}</h3>\n'.format(_imei=IMEI, _time=LOCAL_TIME)	# REP_HEADER.format(_title=rep_title)
-REP_FOOTER = '</table>\n<p align="center"><i># <a href="http://android.saz.lt" target="_blank">http://android.saz.lt</a> #</i></p>\n</body></html>'
+REP_HEADER = ''	# set by device_info(), REP_HEADER.format(_title=rep_title)
+# Artifacts kept in memory (--in-memory) are opened from MEM_DBS, the rest
+# from OUTPUT/db
+def open_db(DB_NAME):
+	if DB_NAME not in MEM_DBS:
+		return sq.connect(OUTPUT+'db'+SEP+DB_NAME)
+	con = sq.connect(':memory:')
+	con.deserialize(mem_image(DB_NAME))
+	return con
+
+def mem_image(DB_NAME):
+	DB_DATA = MEM_DBS[DB_NAME]
+	if DB_DATA[18:20] == b'\x02\x02':	# WAL mode needs a -wal file, in memory it opens as rollback journal
+		DB_DATA = DB_DATA[:18]+b'\x01\x01'+DB_DATA[20:]
+	return DB_DATA
+
+# Another artifact opened on the same connection as SCHEMA, for joins across
+# databases; False when it was not acquired
+def attach_db(con, DB_NAME, SCHEMA):
+	if DB_NAME in MEM_DBS:
+		con.execute("ATTACH DATABASE ':memory:' AS "+SCHEMA)
+		con.deserialize(mem_image(DB_NAME), name=SCHEMA)
+	elif os.path.isfile(OUTPUT+'db'+SEP+DB_NAME):
+		con.execute("ATTACH DATABASE ? AS "+SCHEMA, (OUTPUT+'db'+SEP+DB_NAME,))
+	else:
+		return False
+	return True
+
+# Rows of a query a batch at a time, so decoders write out as they read and
+# memory does not grow with the table; count is how many rows have gone by
+FETCH_BATCH = 1000
+
+class RowStream:
+	def __init__(self, cursor, batch=FETCH_BATCH):
+		self.cursor, self.batch, self.count = cursor, batch, 0
+		self.rows = cursor.fetchmany(batch)
+
+	def __bool__(self):
+		return self.count > 0 or len(self.rows) > 0
+
+	def __iter__(self):
+		while self.rows:
+			for row in self.rows:
+				self.count += 1
+				yield row
+			self.rows = self.cursor.fetchmany(self.batch)
+
+def db_bytes(DB_NAME):
+	if DB_NAME in MEM_DBS:
+		return MEM_DBS[DB_NAME]
+	with open(OUTPUT+'db'+SEP+DB_NAME, 'rb') as fileh:
+		return fileh.read()
+
+REP_CREDIT = '<p align="center"><i># <a href="http://android.saz.lt" target="_blank">http://android.saz.lt</a> #</i></p>\n</body></html>'
+REP_FOOTER = '</table>\n'+REP_CREDIT
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# REPORT TABLES
+#
+# A table is declared once from its columns, (heading, cell) pairs of markup
+# with {n} for field n of a row, and the formatters of the fields that need
+# escaping or converting. The cells are joined into a single row template up
+# front, so a row is one format() call, and rows are written WRITE_BATCH at a
+# time through a large file buffer.
+# Tables longer than --page-rows go out as numbered pages behind an index
+# page, so a page opens as fast however big the artifact is; --json-tables
+# writes the rows to a data file instead, drawn a screenful at a time
+WRITE_BATCH = 500
+WRITE_BUFFER = 1024*1024
+REP_TABLE = '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1">{0}</tr>\n'
+RENDERED = local()	# rows written and seconds taken, per decoder thread
+
+# Viewer of --json-tables pages: ROWS comes from the _data.js file (a script
+# rather than plain JSON, browsers do not fetch files next to a file:// page)
+# and only the rows in view are put in the table, spacers stand for the rest
+REP_SCROLL = '''<tbody id="rows"></tbody></table></div>
+<script src="{0}"></script>
+<script>
+var TEMPLATE = {1};
+var box = document.getElementById('scroller'), body = document.getElementById('rows');
+var rowh = 20, ahead = 40, measured = false;
+function row_html(row) {{
+	var out = '';
+	for (var i = 0; i < TEMPLATE.length; i++)
+		out += typeof TEMPLATE[i] == 'number' ? row[TEMPLATE[i]] : TEMPLATE[i];
+	return out;
+}}
+function spacer(rows) {{
+	return '<tr><td colspan="99" style="height:'+rows*rowh+'px;padding:0;border:0"></td></tr>';
+}}
+function draw() {{
+	var first = Math.max(0, Math.floor(box.scrollTop/rowh)-ahead);
+	var last = Math.min(ROWS.length, first+Math.ceil(box.clientHeight/rowh)+2*ahead);
+	body.innerHTML = spacer(first)+ROWS.slice(first, last).map(row_html).join('')+spacer(ROWS.length-last);
+	if (!measured && last > first) {{
+		measured = true;
+		rowh = Math.max(1, (body.offsetHeight-(ROWS.length-last+first)*rowh)/(last-first));
+		draw();
+	}}
+}}
+box.onscroll = draw;
+draw();
+</script>
+'''
+
+def rendered(done, T1):
+	RENDERED.rows = getattr(RENDERED, 'rows', 0)+done
+	RENDERED.seconds = getattr(RENDERED, 'seconds', 0)+time.time()-T1
+
+def page_nav(FILE_NAME, number, more):
+	stem = FILE_NAME[:-len('.html')]
+	nav = ['<a href="{0}_{1}.html">&laquo; Previous</a>'.format(stem, number-1) if number > 1 else '&laquo; Previous',
+		'<a href="{0}">Index</a>'.format(FILE_NAME),
+		'Page {0}'.format(number),
+		'<a href="{0}_{1}.html">Next &raquo;</a>'.format(stem, number+1) if more else 'Next &raquo;']
+	return '<p align="center">{0}</p>\n'.format(' | '.join(nav))
+
+class ReportTable:
+	def __init__(self, columns, formats=None):
+		self.head = REP_TABLE.format(''.join(_[0] for _ in columns))
+		self.template = '<tr>'+''.join(_[1] for _ in columns)+'</tr>\n'
+		# the template as text and field numbers, for the --json-tables viewer
+		self.parts = [int(_) if pos % 2 else _ for pos, _ in enumerate(re.split(r'\{(\d+)\}', self.template))]
+		formats = sorted((formats or {}).items())
+		self.fields = self.compile(formats)
+		template, fields = self.template.format, self.fields
+		if formats:
+			self.render = lambda row: template(*fields(row))
+		else:
+			self.render = lambda row: template(*row)
+
+	@staticmethod
+	def compile(formats):
+		if not formats:
+			return tuple
+		def fields(row):
+			row = list(row)
+			for pos, fmt in formats:
+				row[pos] = fmt(row[pos])
+			return row
+		return fields
+
+	def write_rows(self, fileh, rows):
+		T1, done, rows = time.time(), 0, iter(rows)
+		fileh.write(self.head)
+		batch = list(islice(rows, WRITE_BATCH))
+		while batch:
+			fileh.write(''.join(map(self.render, batch)))
+			done += len(batch)
+			batch = list(islice(rows, WRITE_BATCH))
+		rendered(done, T1)
+		return done
+
+	def write(self, FILE_NAME, rep_title, rows, before=''):
+		if ARGS.json_tables:
+			return self.write_json(FILE_NAME, rep_title, rows, before)
+		rows = iter(rows)
+		if ARGS.page_rows > 0:
+			page = list(islice(rows, ARGS.page_rows))
+			following = list(islice(rows, ARGS.page_rows))
+			if following:
+				return self.write_pages(FILE_NAME, rep_title, page, following, rows, before)
+			rows = page
+		with open(OUTPUT+FILE_NAME, 'w', encoding='UTF-8', buffering=WRITE_BUFFER) as fileh:
+			fileh.write(REP_HEADER.format(_title=rep_title)+before)
+			done = self.write_rows(fileh, rows)
+			fileh.write(REP_FOOTER)
+		return done
+
+	# Pages are FILE_NAME_1.html, FILE_NAME_2.html..., one page read ahead so
+	# each knows if it has a next one; FILE_NAME itself becomes the index
+	def write_pages(self, FILE_NAME, rep_title, page, following, rows, before):
+		pages, done = [], 0
+		while page:
+			number = len(pages)+1
+			PAGE_NAME = '{0}_{1}.html'.format(FILE_NAME[:-len('.html')], number)
+			nav = page_nav(FILE_NAME, number, following)
+			with open(OUTPUT+PAGE_NAME, 'w', encoding='UTF-8', buffering=WRITE_BUFFER) as fileh:
+				fileh.write(REP_HEADER.format(_title='{0}, page {1}'.format(rep_title, number))+(before if number == 1 else '')+nav)
+				self.write_rows(fileh, page)
+				fileh.write('</table>\n'+nav+REP_CREDIT)
+			pages.append((PAGE_NAME, number, '{0:,}'.format(done+1), '{0:,}'.format(done+len(page))))
+			done += len(page)
+			page, following = following, list(islice(rows, ARGS.page_rows))
+		with open(OUTPUT+FILE_NAME, 'w', encoding='UTF-8') as fileh:
+			fileh.write(REP_HEADER.format(_title=rep_title)+'<p align="center">{0:,} rows in {1} pages</p>\n'.format(done, len(pages))+PAGES_TABLE.head)
+			fileh.write(''.join(map(PAGES_TABLE.render, pages)))
+			fileh.write(REP_FOOTER)
+		return done
+
+	def write_json(self, FILE_NAME, rep_title, rows, before):
+		T1, done, rows = time.time(), 0, iter(rows)
+		DATA_NAME = FILE_NAME[:-len('.html')]+'_data.js'
+		with open(OUTPUT+DATA_NAME, 'w', encoding='UTF-8', buffering=WRITE_BUFFER) as fileh:
+			fileh.write('var ROWS = [\n')
+			batch = list(islice(rows, WRITE_BATCH))
+			while batch:
+				fileh.write(''.join(json.dumps([str(_) for _ in self.fields(row)], ensure_ascii=False, separators=(',', ':'))+',\n' for row in batch))
+				done += len(batch)
+				batch = list(islice(rows, WRITE_BATCH))
+			fileh.write('];\n')
+		rendered(done, T1)
+		with open(OUTPUT+FILE_NAME, 'w', encoding='UTF-8') as fileh:
+			fileh.write(REP_HEADER.format(_title=rep_title)+before+'<p align="center">{0:,} rows</p>\n<div id="scroller" style="height:85vh;overflow-y:auto">\n'.format(done)+self.head)
+			fileh.write(REP_SCROLL.format(DATA_NAME, json.dumps(self.parts))+REP_CREDIT)
+		return done
+
+PAGES_TABLE = ReportTable([
+	('<th>Page</th>', '<td><a href="{0}">Page {1}</a></td>'),
+	('<th>Rows</th>', '<td>{2} - {3}</td>'),
+	])
+
+# Field formatters
+NUMBER_SPACES = re.compile(r'(?<=\d)\s(?=\d)')
+CALL_TYPES = {1: 'Received', 2: 'Dialled', 3: 'Missed', 5: 'Rejected'}
+SMS_TYPES = {1: 'Inbox', 2: 'Sent', 3: 'Draft', 5: 'Sending failed', 6: 'Sent'}
+
+def blank_none(data):
+	return data if data != None else ''
+
+def escape_text(data):
+	return escape_html(str(data)) if data != None else ''
+
+def phone_number(number):
+	return NUMBER_SPACES.sub('', str(number))
+
+def call_number(number):
+	number = phone_number(number)
+	try:
+		if int(number) <= 0:
+			return 'UNKNOWN'
+	except ValueError:
+		pass
+	return number
+
+def call_type(typ):
+	return CALL_TYPES.get(typ, 'Type({0})'.format(typ))
+
+def sms_type(typ):
+	return SMS_TYPES.get(typ, 'Type({0})'.format(typ))
+
+def duration(seconds):
+	return str(timedelta(seconds=seconds))
+
+def short_title(title):
+	if title != None and len(title) > 60:
+		return escape_html(title)[:55]+'.....'
+	return escape_html(title)
+
+def short_url(url):
+	if len(url) > 60:
+		return url[:45]+'.....'+url[-10:]
+	return url
+
+def email_addresses(data):
+	return re.sub('\x01|\x02', '<br/>', escape_html(data))
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# MEDIA STORE
+#
+# Media blobs kept in databases are stored once each under their SHA-256,
+# however many rows carry them (forwarded media), so same-named media cannot
+# overwrite each other either. A writer thread does the disk writes, at most
+# MEDIA_QUEUE blobs behind the decoder, and closing the store writes
+# manifest.txt: every blob with its size and the rows it came from
+MEDIA_QUEUE = 64
+MEDIA_EXT = re.compile(r'\.[A-Za-z0-9]{1,8}$')
+
+class MediaStore:
+	def __init__(self, MEDIA_PATH):
+		self.path = MEDIA_PATH
+		os.makedirs(OUTPUT+MEDIA_PATH)
+		self.blobs = OrderedDict()	# sha256 -> [file, size, sources]
+		self.failed = []
+		self.pending = BoundedSemaphore(MEDIA_QUEUE)
+		self.writer = ThreadPoolExecutor(max_workers=1)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	# path of blob in the report, written out if it was not seen before
+	def add(self, blob, ext, source):
+		digest = sha256(blob).hexdigest()
+		if digest not in self.blobs:
+			self.blobs[digest] = [self.path+SEP+digest+ext, len(blob), []]
+			self.pending.acquire()
+			self.writer.submit(self.write, self.blobs[digest][0], blob)
+		self.blobs[digest][2].append(source)
+		return self.blobs[digest][0]
+
+	def write(self, FILE_NAME, blob):
+		try:
+			with open(OUTPUT+FILE_NAME, 'wb') as fileh:
+				fileh.write(blob)
+		except OSError as e:
+			self.failed.append('{0} ({1})'.format(FILE_NAME, e))
+		finally:
+			self.pending.release()
+
+	def close(self):
+		self.writer.shutdown(wait=True)
+		for fail in self.failed:
+			ERRORS.append('Media file could not be written: {0}'.format(fail))
+		with open(OUTPUT+self.path+SEP+'manifest.txt', 'w', encoding='UTF-8') as fileh:
+			fileh.write('sha256\tbytes\tfile\tsources\n')
+			for digest, blob in self.blobs.items():
+				fileh.write('{0}\t{1}\t{2}\t{3}\n'.format(digest, blob[1], blob[0], ', '.join(blob[2])))
+
+def media_ext(name, default='.jpg'):
+	match = MEDIA_EXT.search(name or '')
+	return match.group().lower() if match else default
 
 # Decode gesture.key  # # # # # # # # # # # # # # # # # # # # #
+# gesture.key is the SHA-1 of the pattern's nodes (0-8, top left to bottom
+# right), 4 to 9 of them. A move may not jump over a node not yet used. All
+# 389,112 patterns are hashed once into a table of SHA-1 + nodes (padded
+# with 0xFF), sorted so it can be binary searched through mmap.
+GESTURE_REC = 29
+GESTURE_COUNT = 389112
+
+def gesture_patterns():
+	def walk(path, used):
+		if len(path) >= 4:
+			yield path
+		if len(path) == 9:
+			return
+		r1, c1 = divmod(path[-1], 3)
+		for node in range(9):
+			r2, c2 = divmod(node, 3)
+			if used & 1 << node:
+				continue
+			if (r1+r2) % 2 == 0 and (c1+c2) % 2 == 0 and not used & 1 << ((r1+r2)//2*3+(c1+c2)//2):
+				continue
+			yield from walk(path+[node], used | 1 << node)
+	for node in range(9):
+		yield from walk([node], 1 << node)
+
+def gesture_table():
+	TABLE = ARGS.gesture_table or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gesture.table')
+	if not os.path.isfile(TABLE) or os.path.getsize(TABLE) != GESTURE_REC*GESTURE_COUNT:
+		print(' Building the gesture pattern table (one-off)...', end='\r')
+		records = sorted(sha1(bytes(_)).digest()+bytes(_).ljust(9, b'\xff') for _ in gesture_patterns())
+		with open(TABLE+'.tmp', 'wb') as fileh:
+			fileh.writelines(records)
+		os.replace(TABLE+'.tmp', TABLE)
+	return TABLE
+
+def gesture_lookup(digest):
+	with open(gesture_table(), 'rb') as fileh, mmap(fileh.fileno(), 0, access=ACCESS_READ) as table:
+		lo, hi = 0, len(table)//GESTURE_REC
+		while lo < hi:
+			mid = (lo+hi)//2
+			key = table[mid*GESTURE_REC:mid*GESTURE_REC+20]
+			if key == digest:
+				return list(table[mid*GESTURE_REC+20:(mid+1)*GESTURE_REC].rstrip(b'\xff'))
+			if key < digest:
+				lo = mid+1
+			else:
+				hi = mid
+
 def decode_gesturekey(file_to_decode):
-	with open(OUTPUT+'db'+SEP+file_to_decode, 'rb') as fileh:
-		ges_data = fileh.read()
+	ges_data = db_bytes(file_to_decode)
 	if len(ges_data) == 20:
 		GKEY = hexlify(ges_data).decode('UTF-8')
-		REPORT.append(['Security (Lockscreen Pattern)', '<a href="http://android.saz.lt/cgi-bin/online_pattern.py?encoded={0}" target="_blank">{0}</a>'.format(GKEY)])
+		try:
+			pattern = gesture_lookup(ges_data)
+		except OSError:
+			pattern = None
+			ERRORS.append('The gesture pattern table could not be built or read.')
+		if pattern != None:
+			REPORT.append(['Security (Lockscreen Pattern)', '{0} (nodes 1-9, top left to bottom right)<br>{1}'.format('-'.join(str(_+1) for _ in pattern), GKEY)])
+		else:
+			REPORT.append(['Security (Lockscreen Pattern)', '<a href="http://android.saz.lt/cgi-bin/online_pattern.py?encoded={0}" target="_blank">{0}</a>'.format(GKEY)])
 # # # # #
 
-# Brute force 8-digit password  # # # # # # # # # # # # # # # #
+# Lockscreen password cracking  # # # # # # # # # # # # # # # #
+# An attack is a plan of stages tried in order, each an ordered run of
+# candidates: 'pins' (LIKELY_PINS), 'mask' (a mask such as ?d?d?d?d) or
+# 'words' (a word list and rules). Stages are cut into batches for a process
+# pool; the first worker to find the password stops the others. The position
+# reached can be saved to a checkpoint file and resumed from.
+CRACK_BATCH = 2000	# candidates per task
+PIN_ROUNDS = [str(_).encode() for _ in range(1, 1024)]
+MASK_SETS = {'d': '0123456789', 'l': 'abcdefghijklmnopqrstuvwxyz', 'u': 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 's': ' !"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~', '?': '?'}
+MASK_SETS['a'] = MASK_SETS['l']+MASK_SETS['u']+MASK_SETS['d']+MASK_SETS['s']
+# Most used PINs first, then years and easy 6 and 8 digit ones, each once;
+# the stages after them skip these
+LIKELY_PINS = list(dict.fromkeys(['1234', '1111', '0000', '1212', '7777', '1004', '2000', '4444', '2222', '6969', '9999', '3333', '5555', '6666', '1122', '1313', '8888', '4321', '2001', '1010'] \
+	+ [str(_) for _ in range(2030, 1939, -1)] \
+	+ ['123456', '654321', '111111', '000000', '123123', '121212', '112233', '12345678', '87654321', '11111111', '00000000', '12341234']))
+LIKELY_TRIED = frozenset(_.encode() for _ in LIKELY_PINS)
+DEFAULT_RULES = [':', 'c', 'u', '$1', '$1$2$3', 'c$1', 'c$!', '$1$2$3$4', 'sa@', 'so0', 'r']
+
+def parse_mask(mask):
+	charsets, pos = [], 0
+	while pos < len(mask):
+		if mask[pos] == '?' and pos+1 < len(mask) and mask[pos+1] in MASK_SETS:
+			charsets.append(MASK_SETS[mask[pos+1]])
+			pos += 2
+		else:
+			charsets.append(mask[pos])
+			pos += 1
+	return charsets
+
+# Subset of the usual rule syntax: : l u c t r d $X ^X sXY
+RULE_WIDTH = {':': 1, 'l': 1, 'u': 1, 'c': 1, 't': 1, 'r': 1, 'd': 1, '$': 2, '^': 2, 's': 3}
+
+def valid_rule(rule):
+	pos = 0
+	while pos < len(rule):
+		width = RULE_WIDTH.get(rule[pos])
+		if width == None or pos+width > len(rule):
+			return False
+		pos += width
+	return True
+
+def apply_rule(rule, word):
+	pos = 0
+	while pos < len(rule):
+		op = rule[pos]
+		if op in '$^':
+			word, pos = word+rule[pos+1] if op == '$' else rule[pos+1]+word, pos+2
+			continue
+		if op == 's':
+			word, pos = word.replace(rule[pos+1], rule[pos+2]), pos+3
+			continue
+		word = {'l': str.lower, 'u': str.upper, 'c': str.capitalize, 't': str.swapcase, 'r': lambda _: _[::-1], 'd': lambda _: _+_}.get(op, lambda _: _)(word)
+		pos += 1
+	return word
+
+def load_rules(RULES_PATH):
+	if not RULES_PATH:
+		return DEFAULT_RULES
+	rules = []
+	with open(RULES_PATH, 'r', encoding='UTF-8') as fileh:
+		for num, line in enumerate(fileh, 1):
+			rule = line.strip().replace(' ', '')
+			if not rule or line.startswith('#'):
+				continue
+			if valid_rule(rule):
+				rules.append(rule)
+			else:
+				ERRORS.append('Rule \'{0}\' on line {1} of {2} is not supported, skipped.'.format(rule, num, RULES_PATH))
+	return rules
+
+def crack_worker_init(stop):
+	global CRACK_STOP
+	CRACK_STOP = stop
+
+def task_candidates(kind, payload, start, stop):
+	if kind == 'mask' and all(_ == MASK_SETS['d'] for _ in payload):
+		for n in range(start, stop):
+			yield b'%0*d' % (len(payload), n)
+	elif kind == 'mask':
+		# odometer from index start, the last position turning fastest
+		pos, n = [], start
+		for charset in reversed(payload):
+			n, r = divmod(n, len(charset))
+			pos.insert(0, r)
+		for _ in range(stop-start):
+			yield ''.join(charset[p] for charset, p in zip(payload, pos)).encode('UTF-8')
+			for i in range(len(pos)-1, -1, -1):
+				pos[i] += 1
+				if pos[i] < len(payload[i]):
+					break
+				pos[i] = 0
+	elif kind == 'words':
+		words, rules = payload
+		for word in words:
+			for rule in rules:
+				yield apply_rule(rule, word).encode('UTF-8')
+	else:
+		for candidate in payload:
+			yield candidate.encode('UTF-8')
+
+# 40 hex digits: 1024 rounds of SHA-1 over round+password+salt; 72: SHA-1 and
+# MD5 of password+salt, the SHA-1 is enough to test with
+def crack_search(task):
+	rounds, target, salt, kind, payload, start, stop, skip, mark = task
+	done = 0
+	if CRACK_STOP.is_set():
+		return None, 0, mark
+	for candidate in task_candidates(kind, payload, start, stop):
+		if skip and candidate in LIKELY_TRIED:
+			continue
+		tail = candidate+salt
+		h0 = sha1(b'0'+tail if rounds else tail).digest()
+		if rounds:
+			for it in PIN_ROUNDS:
+				h0 = sha1(h0+it+tail).digest()
+		done += 1
+		if h0 == target:
+			CRACK_STOP.set()
+			return candidate.decode('UTF-8'), done, mark
+	return None, done, mark
+
+# Tasks of the plan from a checkpoint position on; mark is where a stage
+# stands once the task is done, skip is set behind a 'pins' stage
+def crack_tasks(plan, head, stage, position):
+	for i, (kind, arg) in enumerate(plan):
+		if i < stage:
+			continue
+		start = position if i == stage else 0
+		skip = kind != 'pins' and 'pins' in [_[0] for _ in plan[:i]]
+		if kind == 'words':
+			rules = load_rules(arg[1])
+			if rules == []:
+				ERRORS.append('No usable rules, the word list stage was skipped.')
+				continue
+			per_task = max(1, CRACK_BATCH//len(rules))
+			with open(arg[0], 'r', encoding='UTF-8', errors='replace') as fileh:
+				lines = map(str.rstrip, islice(fileh, start, None))
+				while True:
+					words = list(islice(lines, per_task))
+					if not words:
+						break
+					start += len(words)
+					yield head+('words', (words, rules), 0, 0, skip, (i, start))
+			continue
+		payload = parse_mask(arg) if kind == 'mask' else LIKELY_PINS
+		total = reduce(lambda a, b: a*len(b), payload, 1) if kind == 'mask' else len(payload)
+		for a in range(start, total, CRACK_BATCH):
+			b = min(a+CRACK_BATCH, total)
+			yield head+((kind, payload, a, b) if kind == 'mask' else (kind, payload[a:b], 0, 0))+(skip, (i, b))
+
+# PINs up to max_length digits, unless --pin-max-length says otherwise
+def crack_plan(max_length=8):
+	lengths = range(4, max(4, ARGS.pin_max_length if ARGS.pin_max_length != None else max_length)+1)
+	plan = [('pins', None), ('mask', '?d'*lengths[0])]
+	if ARGS.wordlist:
+		plan.append(('words', (ARGS.wordlist, ARGS.rules)))
+	plan += [('mask', _) for _ in ARGS.mask or []]
+	return plan+[('mask', '?d'*_) for _ in lengths[1:]]
+
+def save_checkpoint(CHECKPOINT, state):
+	with open(CHECKPOINT+'.tmp', 'w') as fileh:
+		json.dump(state, fileh)
+	os.replace(CHECKPOINT+'.tmp', CHECKPOINT)
+
+def crack_pwkey(pwkey, salt, plan, CHECKPOINT=None):
+	pwkey = pwkey.strip()
+	if len(pwkey) not in (40, 72):
+		raise ValueError('password.key of {0} characters is not a known format'.format(len(pwkey)))
+	rounds = len(pwkey) == 40
+	state = {'key': pwkey, 'salt': salt, 'plan': plan, 'stage': 0, 'position': 0, 'tried': 0}
+	if CHECKPOINT and os.path.isfile(CHECKPOINT):
+		with open(CHECKPOINT, 'r') as fileh:
+			saved = json.load(fileh)
+		if [saved.get(_) for _ in ('key', 'salt', 'plan')] == loads(json.dumps([pwkey, salt, plan])):
+			state = saved
+			print(' Resuming from stage {0} of {1}, {2:,} candidates tried'.format(state['stage']+1, len(plan), state['tried']))
+	head = (rounds, unhexlify(pwkey[:40]), salt.encode())
+	per_hash, tried, found = 1024 if rounds else 1, 0, None
+	stop = multiprocessing.Event()
+	T1 = T2 = time.time()
+	with multiprocessing.Pool(ARGS.pin_workers or None, crack_worker_init, (stop,)) as pool:
+		try:
+			# results come back in task order, so the checkpoint never skips ahead
+			for found, done, mark in pool.imap(crack_search, crack_tasks(plan, head, state['stage'], state['position']), 1 if rounds else 20):
+				tried += done
+				if found:
+					break
+				state['stage'], state['position'] = mark
+				if time.time()-T2 > 1:
+					T2 = time.time()
+					print(' Cracking: stage {0} of {1}, {2:,} tried, {3:,.0f} hashes/s'.format(mark[0]+1, len(plan), state['tried']+tried, tried*per_hash/(T2-T1)), end='\r')
+					if CHECKPOINT:
+						save_checkpoint(CHECKPOINT, dict(state, tried=state['tried']+tried))
+		except KeyboardInterrupt:
+			if CHECKPOINT:
+				save_checkpoint(CHECKPOINT, dict(state, tried=state['tried']+tried))
+			raise
+		finally:
+			pool.terminate()
+	rate = tried*per_hash/max(time.time()-T1, 0.001)
+	if CHECKPOINT and os.path.isfile(CHECKPOINT):
+		os.remove(CHECKPOINT)
+	return found, rate
+
+# settings.db and locksettings.db carry the same salt for the same
+# password.key, so it is cracked once and the outcome shared. Decoding runs
+# unattended: a 1024-round key only gets the likely and the 4 digit PINs,
+# longer ones are left to --crack or --pin-max-length
+PIN_CRACKED = {}	# (password.key, salt): PIN, or None if not found
+
 def decode_pwkey(pwkey, pwsalt):
 	if pwsalt > 0:
 		salt = '{:x}'.format(pwsalt)
 	else:
 		salt = hexlify(pack(">q", pwsalt)).decode()
-	print(' Cracking PIN, please wait...', end='\r')
-	if len(pwkey) == 40:
-		pwkey = unhexlify(pwkey)
-		for pin in map('{0:04}'.format,range(10**4)):
-			h0 = sha1(('0'+pin+salt).encode()).digest()
-			for it in map(str,range(1,1024)):
-				h0 = sha1(h0+(it+pin+salt).encode()).digest()
-			if h0 == pwkey:
-				print(' PIN cracked: {0}'.format(pin)+' '*12)
-				return pin
-				break
-		else:
-			ERRORS.append('PIN cracking was attempted, not successful.')
-	elif len(pwkey) == 72:
-		for pin in range(10**8):
-			pin = str(pin).zfill(4)
-			h = sha1((str(pin)+str(salt)).encode()).hexdigest()
-			if h.upper() == pwkey[:40]:
-				print(' PIN cracked: {0}'.format(pin)+' '*12)
-				return pin
-				break
-		else:
-			ERRORS.append('PIN cracking was attempted, not successful.')
-	else:
+	if (pwkey.strip(), salt) in PIN_CRACKED:
+		return PIN_CRACKED[(pwkey.strip(), salt)]
+	try:
+		PIN, rate = crack_pwkey(pwkey, salt, crack_plan(4 if len(pwkey.strip()) == 40 else 8))
+	except ValueError:
 		ERRORS.append('The \'password.key\' file is odd length, PIN cracking failed.')
+		return None
+	PIN_CRACKED[(pwkey.strip(), salt)] = PIN
+	if PIN != None:
+		print(' PIN cracked: {0} ({1:,.0f} hashes/s)'.format(PIN, rate)+' '*24)
+		return PIN
+	print(' PIN not found ({0:,.0f} hashes/s)'.format(rate)+' '*24)
+	ERRORS.append('PIN cracking was attempted, not successful.')
 # # # # #
 
 # Decode accounts.db  # # # # # # # # # # # # # # # # # # # # #
+ACCOUNTS_TABLE = ReportTable([
+	('<th nowrap>Account type</th>', '<td>{1}</td>'),
+	('<th nowrap>Username</th>', '<td>{0}</td>'),
+	('<th nowrap>Password</th>', '<td>{2}</td>'),
+	], {2: blank_none})
+
 def decode_accountsdb(file_to_decode):
 	rep_title = 'Synchronised Accounts'
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
-		acc_data = c.execute("SELECT name,type,password FROM accounts").fetchall()
-	if acc_data != None:
-		with open(OUTPUT+'accounts.html', 'w', encoding='UTF-8') as fileh:
-			fileh.write(REP_HEADER.format(_title=rep_title))
-			if 'photo.png' in DLLS:
-				fileh.write('<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>Main Account Photograph</th></tr>\n<tr><td><a href="db/photo.png" target="_blank"><img src="db/photo.png" height="50%" width="50%"></a></td></tr></table><p/>\n')
-			fileh.write('<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>Account type</th><th nowrap>Username</th><th nowrap>Password</th></tr>\n')
-			for acc_item in acc_data:
-				acc_type = acc_item[1]
-				acc_user = acc_item[0]
-				if acc_item[2] != None:
-					acc_pass = acc_item[2]
-				else:
-					acc_pass = ''
-				fileh.write('<tr><td>{_type}</td><td>{_user}</td><td>{_pass}</td></tr>\n'.format(_type=acc_type, _user=acc_user, _pass=acc_pass))
-			fileh.write(REP_FOOTER)
-		REPORT.append(['System', '<a href="accounts.html">{0} ({1:,})</a>'.format(rep_title, len(acc_data))])
+	acc_photo = ''
+	if 'photo.png' in DLLS:
+		acc_photo = '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>Main Account Photograph</th></tr>\n<tr><td><a href="db/photo.png" target="_blank"><img src="db/photo.png" height="50%" width="50%"></a></td></tr></table><p/>\n'
+	with open_db(file_to_decode) as c:
+		acc_data = RowStream(c.execute("SELECT name,type,password FROM accounts"))
+		ACCOUNTS_TABLE.write('accounts.html', rep_title, acc_data, acc_photo)
+	REPORT.append(['System', '<a href="accounts.html">{0} ({1:,})</a>'.format(rep_title, acc_data.count)])
 # # # # #
 
 # Decode 'Login Data'  # # # # # # # # # # # # # # # # # # # # #
+CHROME_PASSWORDS_TABLE = ReportTable([
+	('<th nowrap>URL</th>', '<td>{0}</td>'),
+	('<th nowrap>Username</th>', '<td>{1}</td>'),
+	('<th nowrap bgcolor="#FF6666">Password</th>', '<td>{2}</td>'),
+	('<th nowrap>Date added</th>', '<td>{3}</td>'),
+	], {0: escape_html, 1: escape_html, 2: lambda _: escape_html(_.decode('UTF-8')), 3: unix_to_utc})
+
 def decode_logindata(file_to_decode):
 	rep_title = 'Google Chrome: Passwords'
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
-		cpw_data = c.execute("SELECT origin_url,username_value,password_value,date_created FROM logins ORDER BY date_created DESC").fetchall()
-	if cpw_data != None:
-		with open(OUTPUT+'chrome_passwords.html', 'w', encoding='UTF-8') as fileh:
-			fileh.write(REP_HEADER.format(_title=rep_title)+'<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>URL</th><th nowrap>Username</th><th nowrap bgcolor="#FF6666">Password</th><th nowrap>Date added</th></tr>\n')
-			for cpw_item in cpw_data:
-				cpw_url = escape_html(cpw_item[0])
-				cpw_user = escape_html(cpw_item[1])
-				cpw_pass = escape_html(cpw_item[2].decode('UTF-8'))
-				cpw_date = unix_to_utc(cpw_item[3])
-				fileh.write('<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td></tr>\n'.format(cpw_url,cpw_user,cpw_pass,cpw_date))
-			fileh.write(REP_FOOTER)
-		REPORT.append(['Web browser', '<a href="chrome_passwords.html">{0} ({1:,})</a>'.format(rep_title, len(cpw_data))])
+	with open_db(file_to_decode) as c:
+		cpw_data = RowStream(c.execute("SELECT origin_url,username_value,password_value,date_created FROM logins ORDER BY date_created DESC"))
+		CHROME_PASSWORDS_TABLE.write('chrome_passwords.html', rep_title, cpw_data)
+	REPORT.append(['Web browser', '<a href="chrome_passwords.html">{0} ({1:,})</a>'.format(rep_title, cpw_data.count)])
 
 # Decode settings.db  # # # # # # # # # # # # # # # # # # # # #
 def decode_settingsdb(file_to_decode):
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
+	with open_db(file_to_decode) as c:
 		try:
 			BT_MAC = c.execute("SELECT value FROM secure WHERE name = 'bluetooth_address'").fetchone()[0].lower()
 			BT_NAME = escape_html(c.execute("SELECT value FROM secure WHERE name = 'bluetooth_name'").fetchone()[0])
@@ -527,7 +2051,7 @@ def decode_settingsdb(file_to_decode):
 
 # Decode 'locksettings.db' for PIN  # # # # # # # # # # # # # #
 def decode_locksettings(file_to_decode):
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
+	with open_db(file_to_decode) as c:
 		try:
 			PW_SALT = c.execute("SELECT value FROM locksettings WHERE name  = 'lockscreen.password_salt'").fetchone()[0]
 			if 'password.key' in DLLS:
@@ -544,305 +2068,226 @@ def decode_locksettings(file_to_decode):
 # # # # # 
 
 # Decode contacts2.db (Pbook) # # # # # # # # # # # # # # # # #
+CONTACTS_TABLE = ReportTable([
+	('<th nowrap>#</th>', '<td nowrap>{0}</td>'),
+	('<th nowrap>Name</th>', '<td nowrap>{1}</td>'),
+	('<th nowrap>Number</th>', '<td nowrap>{2}</td>'),
+	('<th nowrap>Email</th>', '<td nowrap>{3}</td>'),
+	('<th>Other</th>', '<td>{4}</td>'),
+	], {1: escape_html, 2: phone_number})
+
+# Contact data comes one row per contact and mimetype, the values of a
+# mimetype already joined by SQLite and the rows sorted by contact, so each
+# contact is rendered as soon as its rows have gone by. group_concat() keeps
+# the order it is fed in, so the values come from a subquery in data row
+# order (rowid is data._id), the same on every run
+CONTACTS_SQL = "SELECT raw_contact_id, mimetype, group_concat(data1, '<br/>') FROM (SELECT data.raw_contact_id AS raw_contact_id, mimetypes.mimetype AS mimetype, data1 FROM data JOIN mimetypes ON (data.mimetype_id=mimetypes._id){0} WHERE data1 IS NOT NULL AND data1 != '' ORDER BY data.raw_contact_id, mimetypes.mimetype, data.rowid) GROUP BY raw_contact_id, mimetype ORDER BY raw_contact_id"
+VISIBLE_JOIN = " JOIN raw_contacts ON (data.raw_contact_id=raw_contacts._id) JOIN visible_contacts ON (raw_contacts.contact_id=visible_contacts._id)"
+VISIBLE_JOIN_RAW = " JOIN visible_contacts ON (data.raw_contact_id=visible_contacts._id)"	# no raw_contacts table
+
+def contact_row(contact):
+	pb = dict((_[1].split('/')[1], _[2]) for _ in contact[1])
+	pb_name, pb_number, pb_email = pb.pop('name', None), pb.pop('phone_v2', ''), pb.pop('email_v2', '')
+	pb_other = ''.join([(x+': '+pb[x]+'<br/>\n') for x in pb])
+	return contact[0], pb_name, pb_number, pb_email, pb_other
+
 def decode_contacts2db(file_to_decode):
 	rep_title = 'Contacts'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='data'")
 	if c.fetchone() != None:
-		c.execute("SELECT raw_contact_id, mimetypes.mimetype, data1 FROM data JOIN mimetypes ON (data.mimetype_id=mimetypes._id) ORDER BY raw_contact_id")
-		#c.execute("SELECT raw_contact_id, mimetypes.mimetype, data1 FROM data JOIN mimetypes ON (data.mimetype_id=mimetypes._id) JOIN visible_contacts ON (data.raw_contact_id=visible_contacts._id) ORDER BY raw_contact_id")	# alternative
-		c2_data = c.fetchall()
+		c2_join = ''
+		if ARGS.visible_contacts:
+			c2_tables = [_[0] for _ in c.execute("SELECT name FROM sqlite_master WHERE name IN ('visible_contacts', 'raw_contacts')")]
+			if 'visible_contacts' not in c2_tables:
+				ERRORS.append('contacts2.db has no visible_contacts, all contacts are listed.')
+			elif 'raw_contacts' in c2_tables:
+				c2_join = VISIBLE_JOIN
+			else:
+				c2_join = VISIBLE_JOIN_RAW
+		c2_data = RowStream(c.execute(CONTACTS_SQL.format(c2_join)))
+		c2_count = CONTACTS_TABLE.write('contacts.html', rep_title, map(contact_row, groupby(c2_data, itemgetter(0))))
 		con.close()
-		if c2_data != '':
-			fileh = open(OUTPUT+'contacts.html', 'w', encoding='UTF-8')
-			fileh.write(REP_HEADER.format(_title=rep_title)+'<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>#</th><th nowrap>Name</th><th nowrap>Number</th><th nowrap>Email</th><th>Other</th></tr>\n')
-			pbook = []; tD = {}
-			for c2_item in c2_data:
-				c2key = str(c2_item[0])
-				c2typ = c2_item[1].split('/')[1]
-				c2dat = c2_item[2]
-				if c2dat != None and c2dat != '':
-					if tD.get('index_key') == c2key:
-						if c2typ in tD:
-							tD[c2typ] = tD[c2typ]+'<br/>'+c2dat
-						else:
-							tD[c2typ] = c2dat
-					else:
-						if len(tD) > 0:
-							pbook.append(tD); tD = {}
-							tD['index_key'] = c2key
-							tD[c2typ] = c2dat
-						else:
-							tD['index_key'] = c2key
-							tD[c2typ] = c2dat
-			pbook.append(tD); del tD
-			for pb in pbook:
-				pb_index = pb.pop('index_key')
-				try:
-					pb_name = escape_html(pb.pop('name'))
-				except KeyError:
-					pb_name = ''
-				try:
-					pb_number = re.sub(r'(?<=\d)\s(?=\d)', '', pb.pop('phone_v2'))
-				except KeyError:
-					pb_number = ''
-				try:
-					pb_email = pb.pop('email_v2')
-				except KeyError:
-					pb_email = ''
-				try:
-					pb_other = ''.join([(x+': '+pb[x]+'<br/>\n') for x in pb])
-				except:
-					pb_other = ''
-				fileh.write('<tr><td nowrap>{0}</td><td nowrap>{1}</td><td nowrap>{2}</td><td nowrap>{3}</td><td>{4}</td></tr>\n'.format(pb_index, pb_name, pb_number, pb_email, pb_other))
-			fileh.write(REP_FOOTER)
-			fileh.close()
-			REPORT.append(['Communications data', '<a href="contacts.html">{0} ({1:,})</a>'.format(rep_title, len(pbook))])
+		REPORT.append(['Communications data', '<a href="contacts.html">{0} ({1:,})</a>'.format(rep_title, c2_count)])
 # # # # #
 
 # Decode contacts2.db (Calls) # # # # # # # # # # # # # # # # #
+CALLS_TABLE = ReportTable([
+	('<th>#</th>', '<td>{0}</td>'),
+	('<th>Type</th>', '<td>{1}</td>'),
+	('<th>Number</th>', '<td>{2}</td>'),
+	('<th>Name</th>', '<td>{3}</td>'),
+	('<th>Time</th>', '<td>{4}</td>'),
+	('<th>Duration</th>', '<td>{5}</td>'),
+	], {1: call_type, 2: call_number, 3: escape_html, 4: unix_to_utc, 5: duration})
+
 def decode_calls_contacts2db(file_to_decode):
 	rep_title = 'Call logs'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='calls'")
 	if c.fetchone() != None:
 		c.execute("SELECT _id,type,number,name,date,duration FROM calls ORDER by date DESC")
-		c2_data = c.fetchall()
+		c2_data = RowStream(c)
+		if c2_data:
+			CALLS_TABLE.write('call_logs.html', rep_title, c2_data)
+			REPORT.append(['Communications data', '<a href="call_logs.html">{0} ({1:,})</a>'.format(rep_title, c2_data.count)])
 		con.close()
-		if c2_data != []:
-			fileh = open(OUTPUT+'call_logs.html', 'w', encoding='UTF-8')
-			fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>#</th><th>Type</th><th>Number</th><th>Name</th><th>Time</th><th>Duration</th></tr>\n')
-			for c2_item in c2_data:
-				c2_id = str(c2_item[0])
-				c2_type_raw = c2_item[1]
-				if c2_type_raw == 1:
-					c2_type = 'Received'
-				elif c2_type_raw == 2:
-					c2_type = 'Dialled'
-				elif c2_type_raw == 3:
-					c2_type = 'Missed'
-				elif c2_type_raw == 5:
-					c2_type = 'Rejected'
-				else:
-					c2_type = 'Type({0})'.format(c2_type_raw)
-				c2_number = re.sub(r'(?<=\d)\s(?=\d)', '', str(c2_item[2]))
-				try:
-					if int(sec_number) <= 0:
-						c2_number = 'UNKNOWN'
-				except:
-					pass
-				c2_name = escape_html(c2_item[3])
-				c2_date = unix_to_utc(c2_item[4])
-				c2_dur = str(timedelta(seconds=c2_item[5]))
-				fileh.write('<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td><td>{5}</td></tr>\n'.format(c2_id, c2_type, c2_number, c2_name, c2_date, c2_dur))
-			fileh.write(REP_FOOTER)
-			fileh.close()
-			REPORT.append(['Communications data', '<a href="call_logs.html">{0} ({1:,})</a>'.format(rep_title, len(c2_data))])
 # # # # #
 
 # Decode logs.db (Samsung Calls(SEC)) # # # # # # # # # # # # # # # # #
 def decode_logsdb(file_to_decode):
 	rep_title = 'Samsung Call logs'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='logs'")
 	if c.fetchone() != None:
 		c.execute("SELECT _id,type,number,name,date,duration FROM logs WHERE logtype='100' ORDER by date DESC")
-		sec_data = c.fetchall()
+		sec_data = RowStream(c)
+		CALLS_TABLE.write('sec_call_logs.html', rep_title, sec_data)
 		con.close()
-		fileh = open(OUTPUT+'sec_call_logs.html', 'w', encoding='UTF-8')
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>#</th><th>Type</th><th>Number</th><th>Name</th><th>Time</th><th>Duration</th></tr>')
-		for sec_item in sec_data:
-			sec_id = str(sec_item[0])
-			sec_type_raw = sec_item[1]
-			if sec_type_raw == 1:
-				sec_type = 'Received'
-			elif sec_type_raw == 2:
-				sec_type = 'Dialled'
-			elif sec_type_raw == 3:
-				sec_type = 'Missed'
-			elif sec_type_raw == 5:
-				sec_type = 'Rejected'
-			else:
-				sec_type = 'Type({0})'.format(sec_type_raw)
-			sec_number = re.sub(r'(?<=\d)\s(?=\d)', '', str(sec_item[2]))
-			try:
-				if int(sec_number) <= 0:
-					sec_number = 'UNKNOWN'
-			except:
-				pass
-			sec_name = escape_html(sec_item[3])
-			sec_date = unix_to_utc(sec_item[4])
-			sec_dur = str(timedelta(seconds=sec_item[5]))
-			fileh.write('<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td><td>{5}</td></tr>\n'.format(sec_id, sec_type, sec_number, sec_name, sec_date, sec_dur))
-		fileh.write(REP_FOOTER)
-		fileh.close()
-		REPORT.append(['Communications data', '<a href="sec_call_logs.html">{0} ({1:,})</a>'.format(rep_title, len(sec_data))])
+		REPORT.append(['Communications data', '<a href="sec_call_logs.html">{0} ({1:,})</a>'.format(rep_title, sec_data.count)])
 # # # # #
 
 # Decode mmssms.db  # # # # # # # # # # # # # # # # # # # # # #
+SMS_TABLE = ReportTable([
+	('<th>#</th>', '<td>{0}</td>'),
+	('<th>Number</th>', '<td>{1}</td>'),
+	('<th width="500">Message</th>', '<td width="500">{2}</td>'),
+	('<th>Type</th>', '<td>{3}</td>'),
+	('<th nowrap>Time</th>', '<td nowrap>{4}</td>'),
+	], {1: phone_number, 2: escape_text, 3: sms_type, 4: unix_to_utc})
+
 def decode_mmssmsdb(file_to_decode):
 	rep_title = 'SMS Messages'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sms'")
 	if c.fetchone() != None:
-		c.execute("SELECT address,body,date,type,_id FROM sms ORDER by sms.date DESC")
-		sms_data = c.fetchall()
+		c.execute("SELECT _id,address,body,type,date FROM sms ORDER by sms.date DESC")
+		sms_data = RowStream(c)
+		SMS_TABLE.write('mmssms.html', rep_title, sms_data)
 		con.close()
-		fileh = open(OUTPUT+'mmssms.html', 'w', encoding='UTF-8')
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border=1 cellpadding=2 cellspacing=0 align=center>\n<tr bgcolor=#72A0C1><th>#</th><th>Number</th><th width="500">Message</th><th>Type</th><th nowrap>Time</th></tr>\n')
-		for sms_item in sms_data:
-			sms_number = re.sub(r'(?<=\d)\s(?=\d)', '', str(sms_item[0]))
-			sms_text = escape_html(str(sms_item[1]))
-			sms_time = unix_to_utc(sms_item[2])
-			if sms_item[3] == 1:
-				sms_typ = "Inbox"
-			elif sms_item[3] == 2:
-				sms_typ = "Sent"
-			elif sms_item[3] == 3:
-				sms_typ = "Draft"
-			elif sms_item[3] == 5:
-				sms_typ = "Sending failed"
-			elif sms_item[3] == 6:
-				sms_typ = "Sent"
-			else:
-				sms_typ = "Type"+"("+str(sms_item[3])+")"
-			sms_index = sms_item[4]
-			fileh.write('<tr><td>{0}</td><td>{1}</td><td width="500">{2}</td><td>{3}</td><td nowrap>{4}</td></tr>\n'.format(sms_index,sms_number,sms_text,sms_typ,sms_time))
-		fileh.write(REP_FOOTER)
-		fileh.close()
-		REPORT.append(['Communications data', '<a href="mmssms.html">{0} ({1:,})</a>'.format(rep_title, len(sms_data))])
-# # # # # 
+		REPORT.append(['Communications data', '<a href="mmssms.html">{0} ({1:,})</a>'.format(rep_title, sms_data.count)])
+# # # # #
 
 # Decode threads_db2 # # # # # # # # # # # # # # # # # # #
+FB_MESSAGES_TABLE = ReportTable([
+	('<th nowrap>Sender</th>', '<td nowrap><a href="http://www.facebook.com/profile.php?id={0}">{1}</a></td>'),
+	('<th nowrap>Image</th>', '<td><img src="{2}"></td>'),
+	('<th width="500">Message</th>', '<td width="500">{3}</td>'),
+	('<th nowrap>Recipient(s)</th>', '<td nowrap>{4}</td>'),
+	('<th>Time</th>', '<td nowrap>{5}</td>'),
+	], {3: escape_html, 5: unix_to_utc})
+
 def decode_threads_db2(file_to_decode):
 	rep_title = 'Facebook: Messages'
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
-		fbt_data = c.execute("SELECT sender,threads.participants,text,messages.timestamp_ms FROM messages JOIN threads ON (messages.thread_id=threads.thread_id) WHERE NOT messages.timestamp_ms='0' ORDER BY messages.timestamp_ms DESC").fetchall()
-		try:
-			fbt_users = c.execute("SELECT user_key,name,profile_pic_square FROM thread_users").fetchall()
-		except sq.OperationalError:
-			fbt_users = c.execute("SELECT user_key,name,pic_square FROM thread_users").fetchall()
-		except:
-			pass; fbt_users = []
-	if fbt_data != '':
-		fileh = open(OUTPUT+'fb_messages.html', 'w', encoding='UTF-8')
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>Sender</th><th nowrap>Image</th><th width="500">Message</th><th nowrap>Recipient(s)</th><th>Time</th></tr>')
+	fbt_pics = {}	# user_key -> profile picture
+	fbt_parts = {}	# thread_id -> participants, parsed once per thread
+	def fbt_rows():
 		for fbt_item in fbt_data:
 			if fbt_item[0] != None:
-				fbt_sender_nm = escape_html(loads(fbt_item[0]).get('name'))
-				fbt_sender_id = loads(fbt_item[0]).get('user_key')
+				fbt_sender = loads(fbt_item[0])
+				fbt_sender_nm = escape_html(fbt_sender.get('name'))
+				fbt_sender_id = fbt_sender.get('user_key')
 			else:
 				fbt_sender_nm = ''
 				fbt_sender_id = ''
-			for fbimgs in fbt_users:
-				if fbimgs[0] == fbt_sender_id:
-					try:
-						fbt_img = loads(fbimgs[2])[0].get('url')
-					except:
-						fbt_img = fbimgs[2]
-			fbt_text = escape_html(fbt_item[2])
-			fbt_time = unix_to_utc(fbt_item[3])
-			fbt_part = []
-			for fbtdic in loads(fbt_item[1]):
-				fbt_part.append(fbtdic.get('name')+' (ID:'+fbtdic.get('user_key').split(':')[1]+')')
+			if fbt_item[4] not in fbt_parts:
+				fbt_parts[fbt_item[4]] = [_.get('name')+' (ID:'+_.get('user_key').split(':')[1]+')' for _ in loads(fbt_item[1])]
+			fbt_part = list(fbt_parts[fbt_item[4]])
 			try:
 				fbt_part.remove(fbt_sender_nm+' (ID:'+fbt_sender_id.split(':')[1]+')')
 			except:
 				pass
-			fbt_parti = '<br/>'.join(fbt_part)
-			fileh.write('<tr><td nowrap><a href="http://www.facebook.com/profile.php?id={0}">{1}</a></td><td><img src="{2}"></td><td width="500">{3}</td><td nowrap>{4}</td><td nowrap>{5}</td></tr>\n'.format(fbt_sender_id.split(':')[1], fbt_sender_nm, fbt_img, fbt_text, fbt_parti,fbt_time))
-		fileh.write(REP_FOOTER)
-		fileh.close()
-		REPORT.append(['Applications data', '<a href="fb_messages.html">{0} ({1:,})</a>'.format(rep_title, len(fbt_data))])
+			yield fbt_sender_id.partition(':')[2], fbt_sender_nm, fbt_pics.get(fbt_sender_id, ''), fbt_item[2], '<br/>'.join(fbt_part), fbt_item[3]
+	with open_db(file_to_decode) as c:
+		try:
+			fbt_users = c.execute("SELECT user_key,profile_pic_square FROM thread_users")
+		except sq.OperationalError:
+			fbt_users = c.execute("SELECT user_key,pic_square FROM thread_users")
+		except:
+			pass; fbt_users = []
+		for fbt_user in fbt_users:
+			try:
+				fbt_pics[fbt_user[0]] = loads(fbt_user[1])[0].get('url')
+			except:
+				fbt_pics[fbt_user[0]] = fbt_user[1]
+		fbt_data = RowStream(c.execute("SELECT sender,threads.participants,text,messages.timestamp_ms,messages.thread_id FROM messages JOIN threads ON (messages.thread_id=threads.thread_id) WHERE NOT messages.timestamp_ms='0' ORDER BY messages.timestamp_ms DESC"))
+	FB_MESSAGES_TABLE.write('fb_messages.html', rep_title, fbt_rows())
+	REPORT.append(['Applications data', '<a href="fb_messages.html">{0} ({1:,})</a>'.format(rep_title, fbt_data.count)])
 # # # # #
 
 # Decode photos_db # # # # # # # # # # # # # # # # # # # # # # #
+FB_PHOTOS_TABLE = ReportTable([
+	('<th>#</th>', '<td>{0}</td>'),
+	('<th>Picture</th>', '<td><a href="{1}" target="_blank"><img src="{2}"></a></td>'),
+	('<th>Owner</th>', '<td><a href="http://www.facebook.com/profile.php?id={3}" target="_blank">{3}</a></td>'),
+	('<th width="500">Caption</th>', '<td width="500">{4}</td>'),
+	('<th nowrap>Date (uploaded)</th>', '<td nowrap>{5}</td>'),
+	], {4: escape_text, 5: unix_to_utc})
+
 def decode_photos_db(file_to_decode):
 	rep_title = 'Facebook: Viewed Photos'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='photos'")
 	if c.fetchone() != None:
-		c.execute("SELECT _id,owner,src_small,src_big,caption,created FROM photos ORDER BY _id DESC")
-		fbp_data = c.fetchall()
-		if len(fbp_data) > 0:
-			fileh = open(OUTPUT+'fb_photos2.html', 'w', encoding='UTF-8')
-			fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>#</th><th>Picture</th><th>Owner</th><th width="500">Caption</th><th nowrap>Date (uploaded)</th></tr>')
-			for fbp_item in fbp_data:
-				fbp_id = fbp_item[0]
-				fbp_owner = str(fbp_item[1])
-				fbp_thm = fbp_item[2]
-				fbp_img = fbp_item[3]
-				if fbp_item[4] == None:
-					fbp_cap = ''
-				else:
-					fbp_cap = fbp_cap = escape_html(str(fbp_item[4]))
-				fbp_date = unix_to_utc(fbp_item[5])
-				fileh.write('<tr><td>{0}</td><td><a href="{1}" target="_blank"><img src="{2}"></a></td><td><a href="http://www.facebook.com/profile.php?id={3}" target="_blank">{4}</a></td><td width="500">{5}</td><td nowrap>{6}</td></tr>\n'.format(fbp_id, fbp_img, fbp_thm, fbp_owner, fbp_owner, fbp_cap, fbp_date))
-			fileh.write(REP_FOOTER)
-			fileh.close()
-			REPORT.append(['Applications data', '<a href="fb_photos2.html">{0} ({1:,})</a>'.format(rep_title, len(fbp_data))])
+		c.execute("SELECT _id,src_big,src_small,owner,caption,created FROM photos ORDER BY _id DESC")
+		fbp_data = RowStream(c)
+		if fbp_data:
+			FB_PHOTOS_TABLE.write('fb_photos2.html', rep_title, fbp_data)
+			REPORT.append(['Applications data', '<a href="fb_photos2.html">{0} ({1:,})</a>'.format(rep_title, fbp_data.count)])
 
 # # # # #
 
 # Decode notifications.db # # # # # # # # # # # # # # # # # #
-def decode_notificationsdb(file_to_decode):
-	rep_title = 'Facebook: Notifications'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
-	c = con.cursor()
-	noti_data = c.execute("SELECT gql_payload FROM gql_notifications ORDER BY updated DESC").fetchall()
-	con.close()
-	fileh = open(OUTPUT+'fb_notifications.html', 'w', encoding='UTF-8')
-	fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>Notifying Users</th><th width="200">Notification Title</th><th width="300">Post Text</th><th width="100">Attachments</th><th nowrap>Time/Location</th></tr>\n')
-	for noti_item in noti_data:
-		noti_d = loads(noti_item[0].decode('UTF-8'))
-		ntf_name = noti_d.get('actors')[0].get('name')
-		ntf_names = [str('<a href="http://www.facebook.com/profile.php?id=')+x.get('id')+str('" target="_blank">')+x.get('name')+str('</a>') for x in noti_d.get('actors')]
-		if len(ntf_names) > 1:
-			ntf_names = str('<br/>')+str(ntf_names[0])+str('<hr>')+'<br/>'.join(ntf_names[1:])
-		else:
-			ntf_names = str('<br/>')+str(ntf_names[0])
-		ntf_title = escape_html(noti_d.get('title').get('text'))
-		ntf_prof = noti_d.get('title').get('ranges')[0].get('entity').get('url')
-		ntf_name_img = noti_d.get('actors')[0].get('profile_picture').get('uri')
-		ntf_sum = escape_html(noti_d.get('summary').get('text'))
-		ntf_url = noti_d.get('url')
-		ntf_time = unix_to_utc(noti_d.get('creation_time'))
-		try:	# Message, if any.!
-			ntf_msg = escape_html(noti_d.get('message').get('text'))
-		except:
-			ntf_msg = ''
-		try:	# Location, if any!
-			ntf_loc_name = noti_d.get('implicit_place').get('name')
-			ntf_loc_lat = str(noti_d.get('implicit_place').get('location').get('latitude'))
-			ntf_loc_lon = str(noti_d.get('implicit_place').get('location').get('longitude'))
-		except:
-			ntf_loc_name = ntf_loc_lat = ntf_loc_lon = ''
-		try:	# Attachments, if any!
-			ntf_att_title = escape_html(noti_d.get('attachments')[0].get('title'))
-			ntf_att_img = noti_d.get('attachments')[0].get('media').get('image').get('uri')
-			ntf_att_thm = noti_d.get('attachments')[0].get('media').get('image_preview').get('uri')
-			ntf_att_desc = noti_d.get('attachments')[0].get('description').get('text').replace('\n', '<br/>')
-		except:
-			ntf_att_title = ntf_att_img = ntf_att_thm =ntf_att_desc = ''
-		try:	# Attached Story, if any!
-			ntf_atts_msg = escape_html(noti_d.get('attached_story').get('message').get('text').replace('\r', '<br/>').replace('\n', '<br/>'))
-			ntf_atts_img = noti_d.get('attached_story').get('attachments')[0].get('media').get('image').get('uri')
-			ntf_atts_thm = noti_d.get('attached_story').get('attachments')[0].get('media').get('image_preview').get('uri')
-		except:
-			ntf_atts_msg = ntf_atts_thm = ntf_atts_img = ''
-		fileh.write('<tr>\
-	<td nowrap><a href="{0}" target="_blank"><img src="{1}" title="{2}"></a>{16}</td>\
-	<td width="200"><a href="{3}" target="_blank">{4}</a></td>\
-	<td width="300">{17}</td>\
-	<td width="100"><a href="{6}"><img src="{7}"></a><br/>\
-	{5}<a href="{10}"><img src="{11}"></a><br/>{9}</td>\
-	<td nowrap>{12}<br/><a href="http://maps.google.com/maps?q={14},{15}" target="_blank">{13}</a></td>\
-	</tr>\n'.format(
+NOTIFICATIONS_TABLE = ReportTable([
+	('<th nowrap>Notifying Users</th>', '<td nowrap><a href="{0}" target="_blank"><img src="{1}" title="{2}"></a>{16}</td>'),
+	('<th width="200">Notification Title</th>', '<td width="200"><a href="{3}" target="_blank">{4}</a></td>'),
+	('<th width="300">Post Text</th>', '<td width="300">{17}</td>'),
+	('<th width="100">Attachments</th>', '<td width="100"><a href="{6}"><img src="{7}"></a><br/>{5}<a href="{10}"><img src="{11}"></a><br/>{9}</td>'),
+	('<th nowrap>Time/Location</th>', '<td nowrap>{12}<br/><a href="http://maps.google.com/maps?q={14},{15}" target="_blank">{13}</a></td>'),
+	], {12: unix_to_utc})
+
+def notification_row(noti_item):
+	noti_d = loads(noti_item[0].decode('UTF-8'))
+	ntf_name = noti_d.get('actors')[0].get('name')
+	ntf_names = [str('<a href="http://www.facebook.com/profile.php?id=')+x.get('id')+str('" target="_blank">')+x.get('name')+str('</a>') for x in noti_d.get('actors')]
+	if len(ntf_names) > 1:
+		ntf_names = str('<br/>')+str(ntf_names[0])+str('<hr>')+'<br/>'.join(ntf_names[1:])
+	else:
+		ntf_names = str('<br/>')+str(ntf_names[0])
+	ntf_title = escape_html(noti_d.get('title').get('text'))
+	ntf_prof = noti_d.get('title').get('ranges')[0].get('entity').get('url')
+	ntf_name_img = noti_d.get('actors')[0].get('profile_picture').get('uri')
+	ntf_sum = escape_html(noti_d.get('summary').get('text'))
+	ntf_url = noti_d.get('url')
+	try:	# Message, if any.!
+		ntf_msg = escape_html(noti_d.get('message').get('text'))
+	except:
+		ntf_msg = ''
+	try:	# Location, if any!
+		ntf_loc_name = noti_d.get('implicit_place').get('name')
+		ntf_loc_lat = str(noti_d.get('implicit_place').get('location').get('latitude'))
+		ntf_loc_lon = str(noti_d.get('implicit_place').get('location').get('longitude'))
+	except:
+		ntf_loc_name = ntf_loc_lat = ntf_loc_lon = ''
+	try:	# Attachments, if any!
+		ntf_att_title = escape_html(noti_d.get('attachments')[0].get('title'))
+		ntf_att_img = noti_d.get('attachments')[0].get('media').get('image').get('uri')
+		ntf_att_thm = noti_d.get('attachments')[0].get('media').get('image_preview').get('uri')
+		ntf_att_desc = noti_d.get('attachments')[0].get('description').get('text').replace('\n', '<br/>')
+	except:
+		ntf_att_title = ntf_att_img = ntf_att_thm =ntf_att_desc = ''
+	try:	# Attached Story, if any!
+		ntf_atts_msg = escape_html(noti_d.get('attached_story').get('message').get('text').replace('\r', '<br/>').replace('\n', '<br/>'))
+		ntf_atts_img = noti_d.get('attached_story').get('attachments')[0].get('media').get('image').get('uri')
+		ntf_atts_thm = noti_d.get('attached_story').get('attachments')[0].get('media').get('image_preview').get('uri')
+	except:
+		ntf_atts_msg = ntf_atts_thm = ntf_atts_img = ''
+	return (
 	ntf_prof, 			#0
 	ntf_name_img, 		#1
 	ntf_name, 			#2
@@ -855,378 +2300,331 @@ def decode_notificationsdb(file_to_decode):
 	ntf_atts_msg, 		#9
 	ntf_atts_img, 		#10
 	ntf_atts_thm, 		#11
-	ntf_time,			#12
+	noti_d.get('creation_time'),	#12
 	ntf_loc_name,		#13
 	ntf_loc_lat,		#14
 	ntf_loc_lon,		#15
 	ntf_names,			#16
 	ntf_msg,			#17
-	))
-	fileh.write(REP_FOOTER)
-	fileh.close()
-	REPORT.append(['Applications data', '<a href="fb_notifications.html">{0} ({1:,})</a>'.format(rep_title, len(noti_data))])
+	)
+
+def decode_notificationsdb(file_to_decode):
+	rep_title = 'Facebook: Notifications'
+	con = open_db(file_to_decode)
+	c = con.cursor()
+	noti_data = RowStream(c.execute("SELECT gql_payload FROM gql_notifications ORDER BY updated DESC"))
+	NOTIFICATIONS_TABLE.write('fb_notifications.html', rep_title, map(notification_row, noti_data))
+	con.close()
+	REPORT.append(['Applications data', '<a href="fb_notifications.html">{0} ({1:,})</a>'.format(rep_title, noti_data.count)])
 # # # # #
 
 # Decode fb.db  # # # # # # # # # # # # # # # # # # # # # # # #
 def decode_fbdb(file_to_decode):
 	rep_title = 'Facebook: Viewed Photos'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	def fbp_rows():
+		for fbp_item in fbp_data:
+			if fbp_item[6] != None:		# thumbnail kept in the database, shown instead of src_small
+				fbp_item = fbp_item[:2]+(fb_media.add(fbp_item[6], '.jpg', 'photo '+str(fbp_item[0])),)+fbp_item[3:]
+			yield fbp_item
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='photos'")
 	if c.fetchone() != None:
-		c.execute("SELECT _id,owner,src_small,src_big,caption,created,thumbnail FROM photos ORDER BY _id DESC")
-		fbp_data = c.fetchall()
-		if len(fbp_data) > 0:
-			os.mkdir(OUTPUT+'fb_media'); os.mkdir(OUTPUT+'fb_media'+SEP+'Thumbs')
-			fileh = open(OUTPUT+'fb_photos.html', 'w', encoding='UTF-8')
-			fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>#</th><th>Picture</th><th>Owner</th><th width="500">Caption</th><th nowrap>Date (uploaded)</th></tr>\n')
-			for fbp_item in fbp_data:
-				fbp_id = fbp_item[0]
-				fbp_owner = str(fbp_item[1])
-				fbp_thm = fbp_item[2]
-				fbp_img = fbp_item[3]
-				fbp_cap = escape_html(str(fbp_item[4]))
-				fbp_date = unix_to_utc(fbp_item[5])
-				if fbp_item[6] != None:
-					filewa = open(OUTPUT+'fb_media'+SEP+'Thumbs'+SEP+str(fbp_id)+'.jpg', 'wb')
-					filewa.write(fbp_item[6]); filewa.close()					
-					fbp_thumb = 'fb_media'+SEP+'Thumbs'+SEP+str(fbp_id)+'.jpg'
-				else:
-					fbp_thumb = fbp_item[2]
-				fileh.write('<tr><td>{0}</td><td><a href="{1}" target="_blank"><img src="{2}"></a></td><td><a href="http://www.facebook.com/profile.php?id={3}" target="_blank">{4}</a></td><td width="500">{5}</td><td nowrap>{6}</td></tr>\n'.format(fbp_id, fbp_img, fbp_thm, fbp_owner, fbp_owner, fbp_cap, fbp_date))
-			fileh.write(REP_FOOTER)
-			fileh.close()
-			REPORT.append(['Applications data', '<a href="fb_photos.html">{0} ({1:,})</a>'.format(rep_title, len(fbp_data))])
+		c.execute("SELECT _id,src_big,src_small,owner,caption,created,thumbnail FROM photos ORDER BY _id DESC")
+		fbp_data = RowStream(c)
+		if fbp_data:
+			with MediaStore('fb_media'+SEP+'Thumbs') as fb_media:
+				FB_PHOTOS_TABLE.write('fb_photos.html', rep_title, fbp_rows())
+			REPORT.append(['Applications data', '<a href="fb_photos.html">{0} ({1:,})</a>'.format(rep_title, fbp_data.count)])
 
-# # # # # 
+# # # # #
 
 # Decode wa.db  # # # # # # # # # # # # # # # # # # # # # # # #
+WA_CONTACTS_TABLE = ReportTable([
+	('<th>Name</th>', '<td>{0}</td>'),
+	('<th>Number</th>', '<td>{1}</td>'),
+	('<th>Status</th>', '<td>{2}</td>'),
+	], {1: phone_number, 2: blank_none})
+
 def decode_wadb(file_to_decode):
 	rep_title = 'WhatsApp Contacts'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='wa_contacts'")
 	if c.fetchone() != None:
 		c.execute("select display_name,number,status from wa_contacts where is_whatsapp_user='1'")
-		wa_data = c.fetchall()
+		wa_data = RowStream(c)
+		WA_CONTACTS_TABLE.write('wa_contacts.html', rep_title, wa_data)
 		con.close()
-		fileh = open(OUTPUT+'wa_contacts.html', 'w', encoding='UTF-8')
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>Name</th><th>Number</th><th>Status</th></tr>\n')
-		for wa_item in wa_data:
-			wa_name = wa_item[0]
-			wa_number = re.sub(r'(?<=\d)\s(?=\d)', '', str(wa_item[1]))
-			wa_status = wa_item[2]
-			if wa_status == None:
-				wa_status = ''
-			fileh.write('<tr><td>{0}</td><td>{1}</td><td>{2}</td></tr>\n'.format(wa_name,wa_number,wa_status))
-		fileh.write(REP_FOOTER)
-		fileh.close()
-		REPORT.append(['Applications data', '<a href="wa_contacts.html">{0} ({1:,})</a>'.format(rep_title, len(wa_data))])
-# # # # # 
+		REPORT.append(['Applications data', '<a href="wa_contacts.html">{0} ({1:,})</a>'.format(rep_title, wa_data.count)])
+# # # # #
 
 # Decode msgstore.db  # # # # # # # # # # # # # # # # # # # # #
+WA_MESSAGES_TABLE = ReportTable([
+	('<th>#</th>', '<td>{0}</td>'),
+	('<th>Number</th>', '<td>{1}</td>'),
+	('<th width="500">Message</th>', '<td width="500">{2}</td>'),
+	('<th nowrap>Time</th>', '<td nowrap>{3}</td>'),
+	('<th>Type</th>', '<td>{4}</td>'),
+	], {3: unix_to_utc})
+
+def wa_message_row(wa_media, wam_item):
+	wam_number = wam_item[1].split('@')[0]
+	if wam_number[0] != 0:	wam_number = '+' + wam_number.split('-')[0]
+	wam_text = escape_html(wam_item[2])		# data
+	if wam_item[4] == 1:		# key_from_me
+		wam_dir = 'Sent'
+	else:
+		wam_dir = 'Inbox'
+	if wam_item[8] != None:			# raw_data
+		if wam_item[7] != None:		# media_name
+			wam_ext = media_ext(wam_item[7].replace('\n', ''))
+		elif wam_item[6] != None:
+			wam_ext = media_ext('.'+wam_item[6].split('/')[-1])	# media_mime_type
+		else:
+			wam_ext = '.jpg'
+		wam_text = '<img src="'+wa_media.add(wam_item[8], wam_ext, 'message '+str(wam_item[0]))+'">'
+		if wam_item[6] != None:
+			wam_text = 'Type: '+str(wam_item[6])+'<br/>'+wam_text
+		if wam_item[7] != None:
+			wam_text = 'Filename: '+str(wam_item[7])+'<br/>'+wam_text
+		if wam_item[9] != 0 and wam_item[10] != 0:		# latitude, longtitude
+			wam_text = '<a href="http://maps.google.com/maps?q='+str(wam_item[9])+','+str(wam_item[10])+'" target="_blank">Map Location: '+str(wam_item[9])+','+str(wam_item[10])+'<br/>'+wam_text+'</a>'
+	return wam_item[0], wam_number, wam_text, wam_item[3], wam_dir
+
 def decode_msgstoredb(file_to_decode):
 	rep_title = 'WhatsApp Messages'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
 	c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='messages'")
 	if c.fetchone() != None:
-		os.mkdir(OUTPUT+'wa_media'); os.mkdir(OUTPUT+'wa_media'+SEP+'Thumbs')
 		c.execute("SELECT _id, key_remote_jid, data, timestamp, key_from_me, media_size, media_mime_type, media_name, raw_data, latitude, longitude FROM messages WHERE NOT status='-1' ORDER BY timestamp DESC")
-		wam_data = c.fetchall()
+		wam_data = RowStream(c)
+		with MediaStore('wa_media'+SEP+'Thumbs') as wa_media:
+			WA_MESSAGES_TABLE.write('wa_messages.html', rep_title, map(partial(wa_message_row, wa_media), wam_data))
 		con.close()
-		fileh = open(OUTPUT+'wa_messages.html', 'w', encoding='UTF-8')
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>#</th><th>Number</th><th width="500">Message</th><th nowrap>Time</th><th>Type</th></tr>\n')
-		for wam_item in wam_data:
-			wam_id = wam_item[0]
-			wam_number = wam_item[1].split('@')[0]
-			if wam_number[0] != 0:	wam_number = '+' + wam_number.split('-')[0]
-			wam_text = escape_html(wam_item[2])		# data
-			wam_date = unix_to_utc(wam_item[3])
-			if wam_item[4] == 1:		# key_from_me
-				wam_dir = 'Sent'
-			else:
-				wam_dir = 'Inbox'
-			if wam_item[8] != None:			# raw_data
-				if wam_item[7] != None:		# media_name
-					wam_fname = wam_item[7].replace('\n', '')
-				elif wam_item[6] != None:
-					wam_fname = str(wam_item[0])+'.'+wam_item[6].split('/')[1]	# media_mime_type
-				else:
-					wam_fname = str(wam_item[0])+'.jpg'
-				with open(OUTPUT+'wa_media'+SEP+'Thumbs'+SEP+wam_fname, 'wb') as filewa:
-					filewa.write(wam_item[8])	# raw_data, writes file
-				wam_text = '<img src="'+'wa_media'+SEP+'Thumbs'+SEP+wam_fname+'">'
-				if wam_item[6] != None:
-					wam_text = 'Type: '+str(wam_item[6])+'<br/>'+wam_text
-				if wam_item[7] != None:
-					wam_text = 'Filename: '+str(wam_item[7])+'<br/>'+wam_text
-				if wam_item[9] != 0 and wam_item[10] != 0:		# latitude, longtitude
-					wam_text = '<a href="http://maps.google.com/maps?q='+str(wam_item[9])+','+str(wam_item[10])+'" target="_blank">Map Location: '+str(wam_item[9])+','+str(wam_item[10])+'<br/>'+wam_text+'</a>'
-			fileh.write('<tr><td>{0}</td><td>{1}</td><td width="500">{2}</td><td nowrap>{3}</td><td>{4}</td></tr>\n'.format(wam_id, wam_number, wam_text, wam_date, wam_dir))
-		fileh.write(REP_FOOTER)
-		fileh.close()
-		REPORT.append(['Applications data', '<a href="wa_messages.html">{0} ({1:,})</a>'.format(rep_title, len(wam_data))])
-# # # # # 
+		REPORT.append(['Applications data', '<a href="wa_messages.html">{0} ({1:,})</a>'.format(rep_title, wam_data.count)])
+# # # # #
 
 # Decode Kik Messenger kikDatabase.db # # # # # # # # # # # # #
+KIK_TABLE = ReportTable([
+	('<th>#</th>', '<td>{0}</td>'),
+	('<th>Username</th>', '<td>{1}</td>'),
+	('<th width="300">Message</th>', '<td width="300">{2}</td>'),
+	('<th>Type</th>', '<td>{3}</td>'),
+	('<th nowrap>Time</th>', '<td nowrap>{4}</td>'),
+	], {4: unix_to_utc})
+
+def kik_row(kik_item):
+	if kik_item[5] != 0:
+		kik_msg = escape_text(kik_item[1])
+	else:
+		kik_msg = 'Media Content ID: '+kik_item[6]
+	if kik_item[3] == 1:
+		kik_typ = 'Sent'
+	elif kik_item[3] == 0:
+		kik_typ = 'Inbox'
+	else:
+		kik_typ = 'Unknown'
+	return kik_item[0], kik_item[2], kik_msg, kik_typ, kik_item[4]
+
 def decode_kikDatabasedb(file_to_decode):
 	rep_title = 'Kik Messages'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
+	con = open_db(file_to_decode)
 	c = con.cursor()
-	kik_data = c.execute("SELECT messagesTable._id,body,user_name,was_me,timestamp,length,content_id FROM messagesTable JOIN KIKcontactsTable ON (messagesTable.partner_jid=KIKcontactsTable.jid) ORDER BY timestamp DESC").fetchall()
+	kik_data = RowStream(c.execute("SELECT messagesTable._id,body,user_name,was_me,timestamp,length,content_id FROM messagesTable JOIN KIKcontactsTable ON (messagesTable.partner_jid=KIKcontactsTable.jid) ORDER BY timestamp DESC"))
+	KIK_TABLE.write('kik_messages.html', rep_title, map(kik_row, kik_data))
 	con.close()
-	fileh = open(OUTPUT+'kik_messages.html', 'w', encoding='UTF-8')
-	fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>#</th><th>Username</th><th width="300">Message</th><th>Type</th><th nowrap>Time</th></tr>\n')
-	for kik_item in kik_data:
-		kik_id = kik_item[0]
-		kik_num = kik_item[2]
-		if kik_item[5] != 0:
-			kik_msg = escape_html(str(kik_item[1]))
-		else:
-			kik_msg = 'Media Content ID: '+kik_item[6]
-		if kik_item[3] == 1:
-			kik_typ = 'Sent'
-		elif kik_item[3] == 0:
-			kik_typ = 'Inbox'
-		else:
-			kik_typ = 'Unknown'
-		kik_time = unix_to_utc(kik_item[4])
-		fileh.write('<tr><td>{0}</td><td>{1}</td><td width="300">{2}</td><td>{3}</td><td nowrap>{4}</td></tr>\n'.format(kik_id, kik_num, kik_msg, kik_typ, kik_time))
-	fileh.write(REP_FOOTER)
-	fileh.close()
-	REPORT.append(['Applications data', '<a href="kik_messages.html">{0} ({1:,})</a>'.format(rep_title, len(kik_data))])
-# # # # # 
+	REPORT.append(['Applications data', '<a href="kik_messages.html">{0} ({1:,})</a>'.format(rep_title, kik_data.count)])
+# # # # #
 
 # Decode BBM master.db  # # # # # # # # # # # # # # # # # # # #
+BBM_TABLE = ReportTable([
+	('<th>#</th>', '<td>{0}</td>'),
+	('<th>Sender Name</th>', '<td nowrap>{5}</td>'),
+	('<th nowrap>Sender PIN</th>', '<td>{1}</td>'),
+	('<th>Recipient PIN</th>', '<td>{8}</td>'),
+	('<th width="300">Message</th>', '<td width="300">{2}{6}{7}</td>'),
+	('<th nowrap>Type</th>', '<td nowrap>{3}</td>'),
+	('<th nowrap>Time</th>', '<td nowrap>{4}</td>'),
+	], {2: escape_text, 4: unix_to_utc})
+
 def decode_masterdb(file_to_decode):
 	rep_title = 'Blackberry Messenger'
-	con = sq.connect(OUTPUT+'db'+SEP+file_to_decode)
-	c = con.cursor()
-	bbm_data = c.execute("SELECT TextMessageId, UserPins.Pin, IsInbound, TextMessages.Timestamp, Content, PictureTransferId, Users.DisplayName, Type, TextMessages.ConversationId FROM TextMessages JOIN Participants ON (TextMessages.ParticipantId=Participants.ParticipantId) JOIN UserPins ON (Participants.UserId=UserPins.UserId) JOIN Users ON (Participants.UserId=Users.UserId) ORDER BY TextMessages.Timestamp DESC").fetchall()
-	bbm_convs = c.execute("SELECT UserPins.Pin,ConversationId FROM Participants JOIN UserPins ON (Participants.UserId=UserPins.UserId)").fetchall()
-	fileh = open(OUTPUT+'bbm_messenger.html', 'w', encoding='UTF-8')
-	fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1">\n\
-    <th>#</th>\
-	<th>Sender Name</th>\
-    <th nowrap>Sender PIN</th>\
-	<th>Recipient PIN</th>\
-	<th width="300">Message</th>\
-	<th nowrap>Type</th>\
-	<th nowrap>Time</th>\
-	</tr>\n')
-	for bbm_item in bbm_data:
-		bbm_msgid = str(bbm_item[0])
-		bbm_msgpin = str(bbm_item[1])
-		if bbm_item[2] == 1:
-			bbm_msgtype = 'Inbox'
-		else:
-			bbm_msgtype = 'Sent'
-		bbm_msgtime = unix_to_utc(bbm_item[3])
-		bbm_msgtxt = escape_html(str(bbm_item[4]))
-		if bbm_item[5] != None:
-			bbm_msgimg = str('<i>Image #')+str(bbm_item[5])+str('</i>')
-		else:
-			bbm_msgimg = ''
-		bbm_namepin = bbm_item[6]
-		if bbm_item[7] == 1:
-			bbm_mtype = 'PING!'
-		else:
-			bbm_mtype = ''
-		bbm_parts = []
-		for bbm_conv in bbm_convs:
-			if bbm_conv[1] == bbm_item[8]:
-				bbm_parts.append(bbm_conv[0])
-		bbm_parts.remove(bbm_msgpin)
-		bbm_parts = '<br/>'.join(bbm_parts)
-		fileh.write('<tr>\
-	<td>{0}</td>\
-	<td nowrap>{5}</td>\
-	<td>{1}</td>\
-	<td>{8}</td>\
-	<td width="300">{2}{6}{7}</td>\
-	<td nowrap>{3}</td>\
-	<td nowrap>{4}</td>\
-	</tr>\n'.format(
-	bbm_msgid,		#0
+	bbm_convs = {}	# ConversationId -> PINs taking part
+	bbm_recips = {}	# (ConversationId, sender PIN) -> recipients cell
+	def bbm_rows():
+		for bbm_item in bbm_data:
+			bbm_msgpin = str(bbm_item[1])
+			if bbm_item[2] == 1:
+				bbm_msgtype = 'Inbox'
+			else:
+				bbm_msgtype = 'Sent'
+			if bbm_item[5] != None:
+				bbm_msgimg = str('<i>Image #')+str(bbm_item[5])+str('</i>')
+			else:
+				bbm_msgimg = ''
+			if bbm_item[7] == 1:
+				bbm_mtype = 'PING!'
+			else:
+				bbm_mtype = ''
+			if (bbm_item[8], bbm_msgpin) not in bbm_recips:
+				bbm_parts = list(bbm_convs.get(bbm_item[8], []))
+				if bbm_msgpin in bbm_parts:
+					bbm_parts.remove(bbm_msgpin)
+				bbm_recips[(bbm_item[8], bbm_msgpin)] = '<br/>'.join(bbm_parts)
+			yield (
+	bbm_item[0],		#0 message id
 	bbm_msgpin,		#1
-	bbm_msgtxt,		#2
+	bbm_item[4],		#2 text
 	bbm_msgtype,	#3
-	bbm_msgtime,	#4
-	bbm_namepin,	#5
+	bbm_item[3],		#4 time
+	bbm_item[6],		#5 name
 	bbm_msgimg,		#6
 	bbm_mtype,		#7
-	bbm_parts,		#8
-	))
-	fileh.write(REP_FOOTER)
-	fileh.close()
-	REPORT.append(['Applications data', '<a href="bbm_messenger.html">{0} ({1:,})</a>'.format(rep_title, len(bbm_data))])
+	bbm_recips[(bbm_item[8], bbm_msgpin)],		#8
+	)
+	con = open_db(file_to_decode)
+	c = con.cursor()
+	for bbm_conv in c.execute("SELECT UserPins.Pin,ConversationId FROM Participants JOIN UserPins ON (Participants.UserId=UserPins.UserId)"):
+		bbm_convs.setdefault(bbm_conv[1], []).append(str(bbm_conv[0]))
+	# messages come grouped by conversation, newest first within each
+	bbm_data = RowStream(c.execute("SELECT TextMessageId, UserPins.Pin, IsInbound, TextMessages.Timestamp, Content, PictureTransferId, Users.DisplayName, Type, TextMessages.ConversationId FROM TextMessages JOIN Participants ON (TextMessages.ParticipantId=Participants.ParticipantId) JOIN UserPins ON (Participants.UserId=UserPins.UserId) JOIN Users ON (Participants.UserId=Users.UserId) ORDER BY TextMessages.ConversationId, TextMessages.Timestamp DESC"))
+	BBM_TABLE.write('bbm_messenger.html', rep_title, bbm_rows())
+	con.close()
+	REPORT.append(['Applications data', '<a href="bbm_messenger.html">{0} ({1:,})</a>'.format(rep_title, bbm_data.count)])
 # # # # #
 
 # Decode 'wpa_supplicant.conf'or 'flattened-data' # # # # # # #
+WIFI_TABLE = ReportTable([
+	('<th nowrap>SSID</th>', '<td>{0}</td>'),
+	('<th nowrap bgcolor="#FF6666">Password</th>', '<td>{1}{2}</td>'),
+	('<th nowrap>Management</th>', '<td>{3}</td>'),
+	])
+
+def wifi_row(wpa_rawitem):
+	wpa_item = wpa_rawitem.decode().split('\n\t')
+	wpa_d = dict(zip([_.split('=')[0] for _ in wpa_item],[_.split('=')[1] for _ in wpa_item]))
+	return wpa_d.get('ssid', '').strip('"'), wpa_d.get('psk', '').strip('"'), wpa_d.get('wep_key0', '').strip('"'), wpa_d.get('key_mgmt', '')
+
 def decode_wifipw(file_to_decode):
 	rep_title = 'Wi-Fi Passwords'
-	wpa_raw = open(OUTPUT+'db'+SEP+file_to_decode, 'rb').read()
-	with open(OUTPUT+'wifi_passwords.html', 'w', encoding='UTF-8') as fileh:
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>SSID</th><th nowrap bgcolor="#FF6666">Password</th><th nowrap>Management</th></tr>\n')
-		wpa_data = re.findall(b'\{\n\t(.*?)\n\}', wpa_raw, re.DOTALL)
-		wpa_data = [_.decode() for _ in wpa_data]
-		for wpa_rawitem in wpa_data:
-			wpa_item = wpa_rawitem.split('\n\t')
-			wpa_d = dict(zip([_.split('=')[0] for _ in wpa_item],[_.split('=')[1] for _ in wpa_item]))
-			wpa = (wpa_d.get('ssid', '').strip('"'), wpa_d.get('psk', '').strip('"'), wpa_d.get('wep_key0', '').strip('"'), wpa_d.get('key_mgmt', ''))
-			fileh.write('<tr><td>{0}</td><td>{1}{2}</td><td>{3}</td></tr>\n'.format(*wpa))
-		fileh.write(REP_FOOTER)
+	wpa_data = re.findall(b'\{\n\t(.*?)\n\}', db_bytes(file_to_decode), re.DOTALL)
+	WIFI_TABLE.write('wifi_passwords.html', rep_title, map(wifi_row, wpa_data))
 	REPORT.append(['System', '<a href="wifi_passwords.html">{0} ({1:,})</a>'.format(rep_title, len(wpa_data))])
 # # # # #
 
 # Decode 'webview.db' # # # # # # # # # # # # # # # # # # # # #
+WEBVIEW_TABLE = ReportTable([
+	('<th nowrap>#</th>', '<td>{0}</td>'),
+	('<th nowrap>Host</th>', '<td><a href="{1}" target="_blank">{1}</a></td>'),
+	('<th nowrap>Username</th>', '<td>{2}</td>'),
+	('<th nowrap bgcolor="#FF6666">Password</th>', '<td>{3}</td>'),
+	])
+
 def decode_webview(file_to_decode):
 	rep_title = 'Android Web Browser: Passwords'
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
-		wv_data = c.execute("SELECT _id,host,username,password FROM password").fetchall()
-	with open(OUTPUT+'browser_passwords.html', 'w', encoding='UTF-8') as fileh:
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th nowrap>#</th><th nowrap>Host</th><th nowrap>Username</th><th nowrap bgcolor="#FF6666">Password</th></tr>\n')
-		for wv_item in wv_data:
-			fileh.write('<tr><td>{0}</td><td><a href="{1}" target="_blank">{1}</a></td><td>{2}</td><td>{3}</td></tr>\n'.format(*wv_item))
-		fileh.write(REP_FOOTER)
-	REPORT.append(['Web browser', '<a href="browser_passwords.html">{0} ({1:,})</a>'.format(rep_title, len(wv_data))])
+	with open_db(file_to_decode) as c:
+		wv_data = RowStream(c.execute("SELECT _id,host,username,password FROM password"))
+		WEBVIEW_TABLE.write('browser_passwords.html', rep_title, wv_data)
+	REPORT.append(['Web browser', '<a href="browser_passwords.html">{0} ({1:,})</a>'.format(rep_title, wv_data.count)])
 # # # # #
 
 # Decode 'browser2.db' history  # # # # # # # # # # # # # # # #
+# History rows are selected as (title, title, url, url, time, visits): the full
+# title and url go in the tooltips, the short ones in the cells
+HISTORY_COLUMNS = [
+	('<th>Page title</th>', '<td><a title="{0}">{1}</a></td>'),
+	('<th>URL</th>', '<td><a href="{2}" title="{2}">{3}</a></td>'),
+	('<th>Time</th>', '<td nowrap>{4}</td>'),
+	('<th>Frequency</th>', '<td>{5}</td>'),
+	]
+BROWSER_HISTORY_TABLE = ReportTable(HISTORY_COLUMNS, {1: short_title, 3: short_url, 4: unix_to_utc})
+CHROME_HISTORY_TABLE = ReportTable(HISTORY_COLUMNS, {1: short_title, 3: short_url, 4: webkit_to_utc})
+
 def decode_browser2(file_to_decode):
 	rep_title = 'Android Web Browser: History'
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
-		wbh_data = c.execute("SELECT title,url,date,visits FROM history ORDER BY date DESC").fetchall()
-	with open(OUTPUT+'browser_history.html', 'w', encoding='UTF-8') as fileh:
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>Page title</th><th>URL</th><th>Time</th><th>Frequency</th></tr>\n')
-		for wbh_item in wbh_data:
-			wbh_s_title = escape_html(wbh_item[0])
-			if len(wbh_item[0]) > 60:	wbh_s_title = wbh_s_title[:55]+'.....' 
-			wbh_s_url = wbh_item[1]
-			if len(wbh_item[1]) > 60:	wbh_s_url = wbh_s_url[:45]+'.....'+wbh_s_url[-10:]
-			wbh = (
-	wbh_item[0],	#0 full title
-	wbh_s_title,	#1 short title
-	wbh_item[1],	#2 full url
-	wbh_s_url,		#3 short url
-	unix_to_utc(wbh_item[2]),	#4 time
-	wbh_item[3],	#5 freq
-	)
-			fileh.write('<tr>\
-	<td><a title="{0}">{1}</a></td>\
-	<td><a href="{2}" title="{2}">{3}</a></td>\
-	<td nowrap>{4}</td>\
-	<td>{5}</td>\
-	</tr>\n'.format(*wbh))
-		fileh.write(REP_FOOTER)
-	REPORT.append(['Web browser', '<a href="browser_history.html">{0} ({1:,})</a>'.format(rep_title, len(wbh_data))])
+	with open_db(file_to_decode) as c:
+		wbh_data = RowStream(c.execute("SELECT title,title,url,url,date,visits FROM history ORDER BY date DESC"))
+		BROWSER_HISTORY_TABLE.write('browser_history.html', rep_title, wbh_data)
+	REPORT.append(['Web browser', '<a href="browser_history.html">{0} ({1:,})</a>'.format(rep_title, wbh_data.count)])
 # # # # #
 
 # Decode 'History' Chrome # # # # # # # # # # # # # # # # # # #
 def decode_gchistory(file_to_decode):
 	rep_title = 'Google Chrome: History'
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
-		gch_data = c.execute("SELECT title,url,last_visit_time,visit_count FROM urls ORDER BY last_visit_time DESC").fetchall()
-	with open(OUTPUT+'chrome_history.html', 'w', encoding='UTF-8') as fileh:
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>Page title</th><th>URL</th><th>Time</th><th>Frequency</th></tr>\n')
-		for gch_item in gch_data:
-			gch_s_title = escape_html(gch_item[0])
-			if len(gch_item[0]) > 60:	gch_s_title = gch_s_title[:55]+'.....' 
-			gch_s_url = gch_item[1]
-			if len(gch_item[1]) > 60:	gch_s_url = gch_s_url[:45]+'.....'+gch_s_url[-10:]
-			gch = (
-	gch_item[0],	#0 full title
-	gch_s_title,	#1 short title
-	gch_item[1],	#2 full url
-	gch_s_url,		#3 short url
-	webkit_to_utc(gch_item[2]),	#4 time
-	gch_item[3],	#5 freq
-	)
-			fileh.write('<tr>\
-	<td><a title="{0}">{1}</a></td>\
-	<td><a href="{2}" title="{2}">{3}</a></td>\
-	<td nowrap>{4}</td>\
-	<td>{5}</td>\
-	</tr>\n'.format(*gch))
-		fileh.write(REP_FOOTER)
-	REPORT.append(['Web browser', '<a href="chrome_history.html">{0} ({1:,})</a>'.format(rep_title, len(gch_data))])
+	with open_db(file_to_decode) as c:
+		gch_data = RowStream(c.execute("SELECT title,title,url,url,last_visit_time,visit_count FROM urls ORDER BY last_visit_time DESC"))
+		CHROME_HISTORY_TABLE.write('chrome_history.html', rep_title, gch_data)
+	REPORT.append(['Web browser', '<a href="chrome_history.html">{0} ({1:,})</a>'.format(rep_title, gch_data.count)])
 # # # # #
 
 # Decode 'Archived History' Chrome  # # # # # # # # # # # # # #
 def decode_gcahistory(file_to_decode):
 	rep_title = 'Google Chrome: Archived History'
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
-		gcah_data = c.execute("SELECT title,url,last_visit_time,visit_count FROM urls ORDER BY last_visit_time DESC").fetchall()
-	with open(OUTPUT+'chrome_archived_history.html', 'w', encoding='UTF-8') as fileh:
-		fileh.write(REP_HEADER.format(_title=rep_title) + '<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>Page title</th><th>URL</th><th>Time</th><th>Frequency</th></tr>\n')
-		for gcah_item in gcah_data:
-			gcah_s_title = escape_html(gcah_item[0])
-			if len(gcah_item[0]) > 60:	gcah_s_title = gcah_s_title[:55]+'.....' 
-			gcah_s_url = gcah_item[1]
-			if len(gcah_item[1]) > 60:	gcah_s_url = gcah_s_url[:45]+'.....'+gcah_s_url[-10:]
-			gcah = (
-	gcah_item[0],	#0 full title
-	gcah_s_title,	#1 short title
-	gcah_item[1],	#2 full url
-	gcah_s_url,		#3 short url
-	webkit_to_utc(gcah_item[2]),	#4 time
-	gcah_item[3],	#5 freq
-	)
-			fileh.write('<tr>\
-	<td><a title="{0}">{1}</a></td>\
-	<td><a href="{2}" title="{2}">{3}</a></td>\
-	<td nowrap>{4}</td>\
-	<td>{5}</td>\
-	</tr>\n'.format(*gcah))
-		fileh.write(REP_FOOTER)
-	REPORT.append(['Web browser', '<a href="chrome_archived_history.html">{0} ({1:,})</a>'.format(rep_title, len(gcah_data))])
+	with open_db(file_to_decode) as c:
+		gcah_data = RowStream(c.execute("SELECT title,title,url,url,last_visit_time,visit_count FROM urls ORDER BY last_visit_time DESC"))
+		CHROME_HISTORY_TABLE.write('chrome_archived_history.html', rep_title, gcah_data)
+	REPORT.append(['Web browser', '<a href="chrome_archived_history.html">{0} ({1:,})</a>'.format(rep_title, gcah_data.count)])
 # # # # #
 
 # Decode 'EmailProvider.db' # # # # # # # # # # # # # # # # # #
+EMAIL_AUTH_TABLE = ReportTable([
+	('<th>Protocol</th>', '<td>{0}</td>'),
+	('<th>Address</th>', '<td>{1}</td>'),
+	('<th>Port</th>', '<td>{2}</td>'),
+	('<th>Login</th>', '<td>{3}</td>'),
+	('<th nowrap bgcolor="#FF6666">Password</th>', '<td>{4}</td>'),
+	])
+EMAIL_TABLE = ReportTable([
+	('<th>#</th>', '<td>{0}</td>'),
+	('<th>From</th>', '<td>{1}</td>'),
+	('<th>To</th>', '<td>{2}</td>'),
+	('<th>Subject</th>', '<td>{3}</td>'),
+	('<th width="300">Content (snippet)</th>', '<td width="300">{4}</td>'),
+	('<th>Attachment</th>', '<td>{5}</td>'),
+	('<th nowrap>Time</th>', '<td nowrap>{6}</td>'),
+	], {1: email_addresses, 2: email_addresses, 3: escape_html, 6: unix_to_utc})
+
 def decode_emailprov(file_to_decode):
 	rep_title = 'E-mails'
 	EMP_PATH = 'email_body'+SEP
 	os.mkdir(OUTPUT+EMP_PATH)
-	with sq.connect(OUTPUT+'db'+SEP+file_to_decode) as c:
+	def emp_rows():
+		for _ in emp_data:
+			if _[7] != None:		# htmlContent
+				_link, ebody = str(_[0])+'.html', _[7]
+			elif _[8] != None:		# textContent
+				_link, ebody = str(_[0]), _[8]
+			else:
+				_link = None
+			if _link:
+				with open(OUTPUT+EMP_PATH+_link, 'w', encoding='UTF-8') as fileb:
+					fileb.write(ebody)
+			_ = list(_[:7])
+			if _[4] != None:		# body snippet
+				_[4] = escape_html(_[4])
+				if _link:	_[4] = '<a href="{0}">{1}</a>'.format(EMP_PATH+_link, _[4])
+			yield _
+	with open_db(file_to_decode) as c:
 		emp_auth = c.execute("SELECT protocol,address,port,login,password FROM HostAuth").fetchall()
-		emp_data = c.execute("SELECT _id,fromList,toList,subject,snippet,flagAttachment,timeStamp FROM Message ORDER BY timeStamp DESC").fetchall()
-		emp_body = sq.connect(OUTPUT+'db'+SEP+'EmailProviderBody.db').execute("SELECT messageKey,htmlContent,textContent FROM Body").fetchall()
-		with open(OUTPUT+'email-provider.html', 'w', encoding='UTF-8') as fh:
+		# each message comes with its body, if EmailProviderBody.db was acquired;
+		# messageKey is not unique, the latest body row of a message is the one
+		# kept (the last one written, as before). Bodies can be large, so fewer
+		# rows are fetched at a time
+		if attach_db(c, 'EmailProviderBody.db', 'body'):
+			emp_data = RowStream(c.execute("SELECT Message._id,fromList,toList,subject,snippet,flagAttachment,timeStamp,htmlContent,textContent FROM Message LEFT JOIN body.Body ON (Body.rowid=(SELECT MAX(rowid) FROM body.Body WHERE messageKey=Message._id)) ORDER BY timeStamp DESC"), 50)
+		else:
+			emp_data = RowStream(c.execute("SELECT _id,fromList,toList,subject,snippet,flagAttachment,timeStamp,NULL,NULL FROM Message ORDER BY timeStamp DESC"))
+		with open(OUTPUT+'email-provider.html', 'w', encoding='UTF-8', buffering=WRITE_BUFFER) as fh:
 			fh.write(REP_HEADER.format(_title=rep_title))
 			if len(emp_auth) != 0:
-				fh.write('<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>Protocol</th><th>Address</th><th>Port</th><th>Login</th><th nowrap bgcolor="#FF6666">Password</th></tr>\n')
-				for _ in emp_auth:
-					fh.write('<tr>\
-	<td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td>{4}</td></tr>\n'.format(*_))
+				EMAIL_AUTH_TABLE.write_rows(fh, emp_auth)
 				fh.write('</table>\n<p/>')
-			if len(emp_data) != 0:
-				fh.write('<table border="1" cellpadding="2" cellspacing="0" align="center">\n<tr bgcolor="#72A0C1">\n<th>#</th><th>From</th><th>To</th><th>Subject</th><th width="300">Content (snippet)</th><th>Attachment</th><th nowrap>Time</th></tr>\n')
-				for _ in emp_data:
-					for _b in emp_body:
-						if _b[0] == _[0]:
-							ebody = _b[1]
-							if ebody == None:
-								ebody = _b[2]
-								open(OUTPUT+EMP_PATH+str(_b[0]), 'w', encoding='UTF-8').write(ebody)
-								_link = str(_b[0])
-							else:
-								open(OUTPUT+EMP_PATH+str(_b[0])+'.html', 'w', encoding='UTF-8').write(ebody)
-								_link = str(_b[0])+'.html'
-					else:
-						try:
-							ebody
-						except:
-							_link = ''
-					_ = list(_)
-					_[1] = re.sub('\x01|\x02', '<br/>', escape_html(_[1]))
-					_[2] = re.sub('\x01|\x02', '<br/>', escape_html(_[2]))
-					_[3] = escape_html(_[3])	# subject
-					if _[4] != None:	_[4] = '<a href="{0}">{1}</a>'.format(str(EMP_PATH+_link),escape_html(_[4]))		# body snippet
-					_[6] = unix_to_utc(_[6])	
-					fh.write('<tr><td>{0}</td><td>{1}</td><td>{2}</td><td>{3}</td><td width="300">{4}</td><td>{5}</td><td nowrap>{6}</td></tr>\n'.format(*_))
+			if emp_data:
+				EMAIL_TABLE.write_rows(fh, emp_rows())
 			fh.write(REP_FOOTER)
-	REPORT.append(['Android E-mail', '<a href="email-provider.html">{0} ({1:,})</a>'.format(rep_title, len(emp_data))])
+	REPORT.append(['Android E-mail', '<a href="email-provider.html">{0} ({1:,})</a>'.format(rep_title, emp_data.count)])
 # # # # #
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
@@ -1260,50 +2658,192 @@ decoders = [
 (decode_masterdb, 'master.db'),
 ]
 
-# Loop for decoding all DB's
+# Decoders of one group run one after another: the two Wi-Fi and the two
+# notifications decoders write the same file, and the settings decoders
+# crack the PIN on every core, so they run on their own once the decoder
+# threads are done (a process pool is best not forked from a busy process)
+DECODER_GROUPS = [('wpa_supplicant.conf', 'flattened-data'), ('notifications.db', 'notifications_db'), ('settings.db', 'locksettings.db')]
+PIN_GROUP = 2
+
+def run_decoder(dec):
+	REPORT.capture(); ERRORS.capture()
+	RENDERED.rows, RENDERED.seconds = 0, 0
+	T1 = time.time()
+	try:
+		dec[0](dec[1])
+		done = True
+	except:
+		done = False
+		ERRORS.append('Unexpected error decoding \'{0}\'!'.format(dec[1]))
+	return done, time.time()-T1, RENDERED.rows, RENDERED.seconds, REPORT.release(), ERRORS.release()
+
+# Loop for decoding all DB's: in a thread pool, merged back in table order
 def decode_databases(DLLS):
 	decoding_start = time.time()
-	for dec in decoders:
-		if dec[1] in DLLS:
-			try:
-				dec[0](dec[1])
-				print(' Decoding \'{0}\': OK'.format(dec[1]))
-			except:
-				print(' Decoding \'{0}\': failed'.format(dec[1]))
-				pass; ERRORS.append('Unexpected error decoding \'{0}\'!'.format(dec[1]))
-	print(' Data decoded in {:.3f} seconds'.format(time.time()-decoding_start))
+	jobs = [dec for dec in decoders if dec[1] in DLLS]
+	groups, results = OrderedDict(), {}
+	for pos, dec in enumerate(jobs):
+		group = [_ for _ in range(len(DECODER_GROUPS)) if dec[1] in DECODER_GROUPS[_]]
+		groups.setdefault(group[0] if group else 'own'+str(pos), []).append(pos)
+	def run_group(group):
+		for pos in group:
+			results[pos] = run_decoder(jobs[pos])
+	with ThreadPoolExecutor(max(1, ARGS.decode_workers)) as pool:
+		for group in [groups[_] for _ in groups if _ != PIN_GROUP]:
+			pool.submit(run_group, group)
+	run_group(groups.get(PIN_GROUP, []))
+	total_rows = total_seconds = 0
+	for pos, dec in enumerate(jobs):
+		done, seconds, rows, render_seconds, report_ops, error_ops = results[pos]
+		REPORT.replay(report_ops)
+		ERRORS.replay(error_ops)
+		total_rows += rows; total_seconds += render_seconds
+		rate = ', {0:,} rows, {1:,.0f} rows/s'.format(rows, rows/max(render_seconds, 1e-6)) if rows else ''
+		print(' Decoding \'{0}\': {1} ({2:.3f} s{3})'.format(dec[1], 'OK' if done else 'failed', seconds, rate))
+	print(' Data decoded in {0:.3f} seconds, {1:,} report rows written at {2:,.0f} rows/s'.format(time.time()-decoding_start, total_rows, total_rows/max(total_seconds, 1e-6)))
+
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# REPORTING
+#
+def write_report():
+	# Error log file
+	if ERRORS != []:
+		for err in ERRORS:
+			with open(OUTPUT+'log-errors.log', 'a', encoding='UTF-8') as fileh:
+				fileh.write('#{0}\t{1}\r\n'.format(ERRORS.index(err)+1, err))
 
-if DLLS != []:
-	print('{0:\u00B0^60}'.format(' Decoding data '))
-	decode_databases(DLLS)
+	print('{0:\u00B0^60}'.format(' Generating report '))
 
-# Error log file
-if ERRORS != []:
-	for err in ERRORS:
-		with open(OUTPUT+'log-errors.log', 'a', encoding='UTF-8') as fileh:
-			fileh.write('#{0}\t{1}\r\n'.format(ERRORS.index(err)+1, err))
+	with open(OUTPUT+'REPORT.html', 'w', encoding='UTF-8') as file_handle:
+		file_handle.write('<!DOCTYPE html><html><head><meta charset="UTF-8">\n<title>Andriller Report for {_imei}</title>\n<style>body,td,tr {{font-family: Vernada, Arial, sans-serif; font-size: 12px;}}</style></head><body>\n<p align="center"><i># This report was generated using Andriller version {_av} on {_time} #</i></p><h3 align="center">[Andriller Report] {_dma} {_dmo} | {_imei}</h3>\n<table border="1" cellpadding=2 cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>Type</th><th>Data</th></tr>\n'.format(_imei=IMEI, _av=__version__, _time=LOCAL_TIME, _dma=DEVICE_MANUF, _dmo=DEVICE_MODEL))
+		for torep in REPORT:
+			file_handle.write('<tr><td>{0}:</td><td>'.format(torep[0]))
+			if type(torep[1]) is list:
+				for tore in torep[1]:
+					file_handle.write('{0}<br/>'.format(tore))
+				file_handle.write('</td></tr>\n')
+			else:
+				file_handle.write('{0}</td></tr>\n'.format(torep[1]))
+		file_handle.write(REP_FOOTER)
+
+	# Print generated report path & open browser:
+	print(" Completed in {:.0f} seconds!".format(time.time()-extraction_started))
+	if ARGS.all_devices:
+		print(' Report saved: ' + os.getcwd()+SEP+OUTPUT+'REPORT.html')
+		return
+	try:
+		open_new_tab(os.getcwd()+SEP+OUTPUT+'REPORT.html')
+	except:	
+		print(' Report saved: ' + os.getcwd()+SEP+OUTPUT+'REPORT.html')
+		input(" Press 'Enter' to exit.")
 
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
-# REPORTING
+# RUNNING
 #
-print('{0:\u00B0^60}'.format(' Generating report '))
-
-with open(OUTPUT+'REPORT.html', 'w', encoding='UTF-8') as file_handle:
-	file_handle.write('<!DOCTYPE html><html><head><meta charset="UTF-8">\n<title>Andriller Report for {_imei}</title>\n<style>body,td,tr {{font-family: Vernada, Arial, sans-serif; font-size: 12px;}}</style></head><body>\n<p align="center"><i># This report was generated using Andriller version {_av} on {_time} #</i></p><h3 align="center">[Andriller Report] {_dma} {_dmo} | {_imei}</h3>\n<table border="1" cellpadding=2 cellspacing="0" align="center">\n<tr bgcolor="#72A0C1"><th>Type</th><th>Data</th></tr>\n'.format(_imei=IMEI, _av=__version__, _time=LOCAL_TIME, _dma=DEVICE_MANUF, _dmo=DEVICE_MODEL))
-	for torep in REPORT:
-		file_handle.write('<tr><td>{0}:</td><td>'.format(torep[0]))
-		if type(torep[1]) is list:
-			for tore in torep[1]:
-				file_handle.write('{0}<br/>'.format(tore))
-			file_handle.write('</td></tr>\n')
-		else:
-			file_handle.write('{0}</td></tr>\n'.format(torep[1]))
-	file_handle.write(REP_FOOTER)
+# Device information, acquisition, decoding and report for one device
+def run_device(serial=None):
+	global extraction_started
+	extraction_started = time.time()
+	device_info(serial)
+	acquire()
+	if DLLS != []:
+		print('{0:\u00B0^60}'.format(' Decoding data '))
+		decode_databases(DLLS)
+	persist_wait()
+	write_report()
 
-# Print generated report path & open browser:
-print(" Completed in {:.0f} seconds!".format(time.time()-extraction_started))
-try:
-	open_new_tab(os.getcwd()+SEP+OUTPUT+'REPORT.html')
-except:	
-	print(' Report saved: ' + os.getcwd()+SEP+OUTPUT+'REPORT.html')
-	input(" Press 'Enter' to exit.")
+# Serials of all attached devices ready for acquisition
+def list_devices():
+	devices = []
+	for line in TRANSPORT.check_output(['devices']).decode('UTF-8').replace('\r', '').split('\n')[1:]:
+		if line.endswith('\tdevice'):
+			devices.append(line.split('\t')[0])
+	return devices
+
+# Entry point of a per-device process, which keeps its own REPORT, ERRORS and OUTPUT
+def device_process(adb, args, transfers, serial):
+	global ADB, ARGS, TRANSFERS, TRANSPORT
+	ADB, ARGS, TRANSFERS = adb, args, transfers
+	TRANSPORT = make_transport()
+	run_device(serial)
+
+# Acquire every attached device at once; one semaphore caps adb transfers for all
+def run_all_devices():
+	serials = list_devices()
+	if serials == []:
+		die(" No Android device found!")
+	print(' Acquiring {0} devices: {1}'.format(len(serials), ', '.join(serials)))
+	transfers = multiprocessing.BoundedSemaphore(ARGS.max_transfers)
+	procs = [multiprocessing.Process(target=device_process, args=(ADB, ARGS, transfers, serial), name=serial) for serial in serials]
+	for proc in procs:
+		proc.start()
+	for proc in procs:
+		proc.join()
+	print('{0:\u00B0^60}'.format(' Summary '))
+	for proc in procs:
+		print(' {0}: {1}'.format(proc.name, 'OK' if proc.exitcode == 0 else 'failed'))
+
+# Lists (and extracts from) an Android backup kept with an earlier case
+def run_catalog(AB_PATH, pattern=None):
+	try:
+		members = query_backup(AB_PATH, pattern or '*')
+	except (ValueError, OSError) as e:
+		die('Cannot read {0}: {1}'.format(AB_PATH, e))
+	for member in members:
+		print(' {0:>12} {1} {2}'.format(member['size'], str(datetime.utcfromtimestamp(int(member['mtime']))), member['name']))
+	print(' {0} members'.format(len(members)))
+	if pattern:
+		T1 = time.time()
+		extract_backup(AB_PATH, [_ for _ in members if _['sha256']], AB_PATH+'_extract')
+		for err in ERRORS:
+			print(' '+err)
+		print(' Extracted into {0} in {1:.3f} seconds'.format(AB_PATH+'_extract', time.time()-T1))
+
+# Cracks a password.key from an earlier case, resuming where a stopped run left off
+def run_crack(KEY_PATH):
+	try:
+		salt = ARGS.salt if ARGS.salt != None else read_salt(ARGS.salt_db)
+		with open(KEY_PATH, 'r') as fileh:
+			pwkey = fileh.read()
+	except (TypeError, ValueError, OSError, sq.Error) as e:
+		die('Cannot get the password.key and salt: {0}'.format(e if ARGS.salt_db else 'give --salt or --salt-db'))
+	salt = '{:x}'.format(salt) if salt > 0 else hexlify(pack(">q", salt)).decode()
+	try:
+		found, rate = crack_pwkey(pwkey, salt, crack_plan(), ARGS.checkpoint or KEY_PATH+'.checkpoint')
+	except KeyboardInterrupt:
+		print('\n Stopped, run the same command again to resume.')
+		sys.exit(1)
+	except (ValueError, OSError) as e:
+		die(str(e))
+	print(' {0} ({1:,.0f} hashes/s)'.format('Password cracked: '+found if found != None else 'Password not found', rate)+' '*24)
+	for err in ERRORS:
+		print(' '+err)
+
+def read_salt(DB_PATH):
+	with sq.connect('file:'+DB_PATH+'?mode=ro', uri=True) as c:
+		for table in ('locksettings', 'secure'):
+			try:
+				row = c.execute("SELECT value FROM {0} WHERE name = 'lockscreen.password_salt'".format(table)).fetchone()
+			except sq.OperationalError:
+				continue
+			if row != None:
+				return int(row[0])
+	raise ValueError('no lockscreen.password_salt in {0}'.format(DB_PATH))
+
+if __name__ == '__main__':
+	ARGS = parser.parse_args()
+	TRANSFERS = BoundedSemaphore(ARGS.max_transfers)
+	print(b64decode(logo).decode().format(__version__, __build_date__, __website__))
+	if ARGS.ab_catalog:
+		run_catalog(ARGS.ab_catalog, ARGS.ab_extract)
+		sys.exit(0)
+	if ARGS.crack:
+		run_crack(ARGS.crack)
+		sys.exit(0)
+	TRANSPORT = make_transport()
+	if not ARGS.replay:
+		find_adb()
+	if ARGS.all_devices:
+		run_all_devices()
+	else:
+		run_device(ARGS.serial)
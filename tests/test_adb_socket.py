@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# AdbSocketTransport against a mock adb server: a threaded socketserver that
+# speaks the host protocol (4 hex digit length, OKAY/FAIL), shell and exec
+# services, and the sync RECV framing (DATA blocks until DONE, or FAIL).
+#   python3 -m unittest discover tests
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import socketserver
+from hashlib import md5, sha256
+from struct import pack, unpack
+from threading import Thread
+from subprocess import CalledProcessError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import Andriller
+
+SERIAL = 'MOCK0001'
+SYNC_BLOCK = 64*1024	# the largest DATA block the real server sends
+
+class MockAdbHandler(socketserver.BaseRequestHandler):
+	def recv_exact(self, size):
+		data = b''
+		while len(data) < size:
+			chunk = self.request.recv(size-len(data))
+			if not chunk:
+				raise EOFError
+			data += chunk
+		return data
+
+	def read_request(self):
+		service = self.recv_exact(int(self.recv_exact(4), 16)).decode('UTF-8')
+		self.server.services.append(service)
+		return service
+
+	def okay(self, payload=None):
+		self.request.sendall(b'OKAY' + (b'' if payload == None else '{0:04x}'.format(len(payload)).encode()+payload))
+
+	def fail(self, msg):
+		self.request.sendall(b'FAIL'+'{0:04x}'.format(len(msg)).encode()+msg)
+
+	def handle(self):
+		try:
+			service = self.read_request()
+			if service == 'host:version':
+				return self.okay(b'0029')
+			if service == 'host:devices':
+				return self.okay(SERIAL.encode()+b'\tdevice\n')
+			if service != 'host:transport:'+SERIAL:
+				return self.fail("device '{0}' not found".format(service.split(':')[-1]).encode())
+			self.okay()
+			service = self.read_request()
+			if service.startswith(('shell:', 'exec:')):
+				cmd = service.split(':', 1)[1]
+				if cmd not in self.server.outputs:
+					return self.fail(b'closed')
+				self.okay()
+				self.request.sendall(self.server.outputs[cmd])
+			elif service == 'sync:':
+				self.server.sync_sessions += 1
+				self.okay()
+				self.sync()
+		except EOFError:
+			pass
+
+	def sync(self):
+		while True:
+			block, length = unpack('<4sI', self.recv_exact(8))
+			if block != b'RECV':
+				return
+			path = self.recv_exact(length).decode('UTF-8')
+			if path not in self.server.files:
+				msg = b'No such file or directory'
+				self.request.sendall(b'FAIL'+pack('<I', len(msg))+msg)
+				continue
+			data = self.server.files[path]
+			for pos in range(0, len(data), SYNC_BLOCK):
+				self.request.sendall(b'DATA'+pack('<I', len(data[pos:pos+SYNC_BLOCK]))+data[pos:pos+SYNC_BLOCK])
+			self.request.sendall(b'DONE'+pack('<I', 0))
+
+class MockAdbServer(socketserver.ThreadingTCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self):
+		socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0), MockAdbHandler)
+		self.services, self.sync_sessions = [], 0
+		self.outputs, self.files = {}, {}
+
+class AdbSocketTransportTest(unittest.TestCase):
+	def setUp(self):
+		self.server = MockAdbServer()
+		Thread(target=self.server.serve_forever, daemon=True).start()
+		self.transport = Andriller.AdbSocketTransport(*self.server.server_address)
+		self.tmp = tempfile.mkdtemp()
+
+	def tearDown(self):
+		for idle in self.transport.sync_idle.values():
+			for sock in idle:
+				sock.close()
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.tmp)
+
+	def test_shell_output(self):
+		self.server.outputs['getprop ro.product.model'] = b'Nexus 5\r\n'
+		out = self.transport.check_output(['-s', SERIAL, 'shell', 'getprop', 'ro.product.model'])
+		self.assertEqual(out, b'Nexus 5\r\n')
+		self.assertEqual(self.server.services, ['host:transport:'+SERIAL, 'shell:getprop ro.product.model'])
+
+	def test_host_services(self):
+		self.assertEqual(self.transport.check_output(['devices']), b'List of devices attached\n'+SERIAL.encode()+b'\tdevice\n')
+		self.assertEqual(self.transport.check_output(['start-server']), b'0029')
+
+	def test_failed_transport(self):
+		with self.assertRaises(CalledProcessError) as caught:
+			self.transport.check_output(['-s', 'GONE0001', 'shell', 'id'])
+		self.assertIn(b'not found', caught.exception.output)
+		proc = self.transport.stream(['-s', 'GONE0001', 'exec-out', 'cat /data/system/gesture.key'])
+		self.assertEqual(proc.stdout.read(), b'')
+		self.assertEqual(proc.wait(), 1)
+
+	def test_exec_stream_hashed(self):
+		data = os.urandom(3*SYNC_BLOCK+17)
+		self.server.outputs['cat /data/system/gesture.key'] = data
+		proc = self.transport.stream(['-s', SERIAL, 'exec-out', 'cat /data/system/gesture.key'])
+		hashes = Andriller.copy_hashed(proc.stdout)
+		proc.stdout.close()
+		self.assertEqual(proc.wait(), 0)
+		self.assertEqual(hashes['sha256'], sha256(data).hexdigest())
+
+	def test_multi_chunk_recv(self):
+		data = os.urandom(5*SYNC_BLOCK+123)
+		self.server.files['/data/data/com.whatsapp/databases/msgstore.db'] = data
+		self.server.files['/data/data/com.whatsapp/databases/wa.db'] = b'wa'
+		local = os.path.join(self.tmp, 'msgstore.db')
+		self.transport.check_output(['-s', SERIAL, 'pull', '/data/data/com.whatsapp/databases/msgstore.db', local])
+		with open(local, 'rb') as file_h:
+			hashes = Andriller.copy_hashed(file_h)
+		self.assertEqual(hashes['md5'], md5(data).hexdigest())
+		self.assertEqual(hashes['sha256'], sha256(data).hexdigest())
+		# the sync session is kept and reused for the next pull
+		self.transport.check_output(['-s', SERIAL, 'pull', '/data/data/com.whatsapp/databases/wa.db', os.path.join(self.tmp, 'wa.db')])
+		self.assertEqual(self.server.sync_sessions, 1)
+
+	def test_failed_recv(self):
+		local = os.path.join(self.tmp, 'contacts2.db')
+		with self.assertRaises(CalledProcessError) as caught:
+			self.transport.check_output(['-s', SERIAL, 'pull', '/data/data/com.android.providers.contacts/databases/contacts2.db', local])
+		self.assertIn(b'No such file', caught.exception.output)
+		self.assertFalse(os.path.exists(local))
+		self.assertEqual(self.transport.sync_idle[SERIAL], [])
+
+if __name__ == '__main__':
+	unittest.main()